@@ -3,6 +3,7 @@ from flask import Flask
 
 from src.common.auth import Auth
 from src.common.log.flask_log import FlaskLogger
+from src.common.metrics import metrics
 from src.common.search import es
 from src.common.sock import sock
 from src.config import config
@@ -18,12 +19,14 @@ def create_app() -> Flask:
     app = APIFlask(__name__)
     Auth(app, User)
     # 初始化后就加载 logger
-    FlaskLogger(app)
+    FlaskLogger(app, server_timing=config.SERVER_TIMING)
 
     # search
     es.init_app(app)
     # websocket
     sock.init_app(app)
+    # prometheus 指标
+    metrics.init_app(app)
 
     app.config.from_object(config)
     regsiter_cli(app)
@@ -1,13 +1,18 @@
+from typing import Any
+from uuid import uuid4
+
 from flask import Blueprint
 from flask.typing import ResponseValue
 from sqlalchemy import delete, select, update
 from src.common.auth import admin_required, current_user
 from src.common.auth.auth import JWTToken
 from src.common.db import session
-from src.util.exception import Created, Deleted, ParameterError, Success, Updated
+from src.common.task import fanout_notice
+from src.util.exception import Created, Deleted, NotFound, ParameterError, Success, Updated
 from src.util.validation import body, parameter
 
-from app.model.comment import Comment
+from app.model.comment import Comment, CommentPage
+from app.model.notice import Notice, NoticeBroadcast
 from app.model.post import Category, Post, PostTag, Tag
 from app.model.user import Permission, Role, RolePermission, User
 from app.schema.admin import (
@@ -16,6 +21,7 @@ from app.schema.admin import (
     CommentUpdateSchema,
     GroupCreateSchema,
     GroupUpdateSchema,
+    NoticeBroadcastSchema,
     PermissionDispatch,
     PermissionDispatchBatch,
     PostSchema,
@@ -373,6 +379,7 @@ def update_comment(body: CommentUpdateSchema, id: int) -> ResponseValue:
     else:
         raise ParameterError(message="操作不允许")
     comment.save()
+    CommentPage.invalidate(comment.post_id)
     return Updated(message="修改评论成功").to_dict()
 
 
@@ -383,7 +390,32 @@ def comment_delete(id: int) -> ResponseValue:
     comment = Comment.get_model_by_id(id)
     if comment is None:
         raise ParameterError(message="评论不存在")
-    with session:
-        session.delete(comment)
-        session.commit()
+    comment.remove()
     return Deleted(message="删除分类成功").to_dict()
+
+
+@bp.post("/notice")
+@admin_required
+@body(NoticeBroadcastSchema)
+def send_system_notice(body: NoticeBroadcastSchema) -> ResponseValue:
+    """发送系统消息给所有用户.
+
+    mode 1: 任务队列中给每个用户写入一条消息, 返回任务 id 用于查询进度;
+    mode 2: 只写入一条全员消息, 用户读取时再记录已读.
+    """
+    if body.mode == 2:
+        broadcast = NoticeBroadcast.send(body.content)
+        return {"id": broadcast.id}
+    job_id = uuid4().hex
+    fanout_notice.delay(job_id, body.content)
+    return {"job_id": job_id}
+
+
+@bp.get("/notice/job/<job_id>")
+@admin_required
+def get_notice_job(job_id: str) -> ResponseValue:
+    """系统消息发送进度."""
+    progress: dict[str, Any] | None = Notice.fanout_progress(job_id)
+    if progress is None:
+        raise NotFound(message="任务不存在或未开始")
+    return progress
@@ -1,12 +1,14 @@
 from flask import Blueprint
-from flask.typing import ResponseValue
+from flask.typing import ResponseReturnValue, ResponseValue
 from sqlalchemy import select
 from src.common.auth import current_user, permission_meta
+from src.common.cache import cache
 from src.common.db import session
-from src.util.exception import Created, ParameterError
+from src.common.task import schedule_comment_ingest
+from src.util.exception import Accepted, ParameterError
 from src.util.validation import body, parameter
 
-from app.model.comment import Comment
+from app.model.comment import Comment, CommentPage
 from app.model.post import Post
 from app.schema.comment import CommentCreateSchema, CommentSchema, ReplaySchema
 
@@ -16,26 +18,9 @@ bp = Blueprint("comment", __name__, url_prefix="/comment")
 @bp.route("", methods=["GET"])
 @parameter(CommentSchema)
 def get_comments(params: CommentSchema) -> ResponseValue:
-    with session:
-        comments = session.scalars(
-            select(Comment)
-            .where(Comment.post_id == params.post_id, Comment.root_id == 0)
-            .offset(params.page * params.count)
-            .limit(params.count)
-        ).all()
-
-        res = {
-            "page": params.page,
-            "count": params.count,
-            "total": Comment.count(),
-            "items": [],
-        }
-        for comment in comments:
-            replay = session.scalars(select(Comment).where(Comment.root_id == comment.id).limit(3)).all()
-            item = comment.to_dict()
-            item["replay"] = replay
-            res["items"].append(item)
-    return res
+    # 评论增删改时整篇文章的分页缓存失效
+    page = cache.get(CommentPage(post_id=params.post_id, page=params.page, count=params.count))
+    return page.dict(exclude={"post_id"})  # type: ignore[union-attr]
 
 
 @bp.route("/replay", methods=["GET"])
@@ -57,30 +42,28 @@ def get_replay(params: ReplaySchema) -> ResponseValue:
 @bp.route("", methods=["POST"])
 @permission_meta(auth="发表评论", module="comment")
 @body(CommentCreateSchema)
-def create_comment(body: CommentCreateSchema) -> ResponseValue:
+def create_comment(body: CommentCreateSchema) -> ResponseReturnValue:
     # 从 request 中获得 ip、客户端、设备信息
     user = current_user.get()
-    post = Post.get_model_by_id(body.post_id)
-    if post is None:
+    # 只查缓存校验, 任务队列写入时会再次确认
+    if not Post.exists(body.post_id):
         raise ParameterError(message="文章不存在")
-    root_comment = None
-    if body.root_id > 0:
-        root_comment = Comment.get_model_by_id(body.root_id)
-        if root_comment is None:
-            raise ParameterError(message="根评论不存在")
-    if body.parent_id > 0:
-        parent_comment = Comment.get_model_by_id(body.parent_id)
-        if parent_comment is None:
-            raise ParameterError(message="父评论不存在")
-    comment = Comment(
+    if body.root_id > 0 and not Comment.exists(body.root_id):
+        raise ParameterError(message="根评论不存在")
+    if body.parent_id > 0 and not Comment.exists(body.parent_id):
+        raise ParameterError(message="父评论不存在")
+    provisional_id = Comment.enqueue(
         post_id=body.post_id,
         user_id=user.id,
         root_id=body.root_id,
         parent_id=body.parent_id,
         content=body.content,
     )
-    comment.save()
-    if root_comment:
-        root_comment.replay_count += 1
-        root_comment.save()
-    return Created(message="创建评论成功").to_dict()
+    schedule_comment_ingest()
+    return {**Accepted(message="评论已提交").to_dict(), "provisional_id": provisional_id}, 202
+
+
+@bp.route("/pending/<provisional_id>", methods=["GET"])
+def get_pending_comment(provisional_id: str) -> ResponseValue:
+    """查询提交的评论是否已写入: id 为 None-处理中, 0-已丢弃."""
+    return {"provisional_id": provisional_id, "id": Comment.pending_status(provisional_id)}
@@ -1,15 +1,13 @@
 from typing import Any
 
 from flask import Blueprint
-from sqlalchemy import update
 from src.common.auth import current_user, login_required
-from src.common.db import session
-from src.util.exception import Forbidden, ParameterError, Updated
-from src.util.validation import parameter
+from src.util.exception import ParameterError, Updated
+from src.util.validation import body, parameter
 
-from app.model.notice import Notice
-from app.schema.common import ResultPageSchema
-from app.schema.notice import NoticeSchema
+from app.model.notice import Notice, NoticeBroadcast
+from app.schema.common import PageSchema, ResultPageSchema
+from app.schema.notice import NoticeReadSchema, NoticeSchema
 
 bp = Blueprint("notice", __name__, url_prefix="/notice")
 
@@ -29,7 +27,7 @@ def get_all_message(params: NoticeSchema) -> dict[str, Any]:
     elif params.type == 0:
         # 获取未读消息
         notices = Notice.get_all(page=params.page, count=params.count, to_user_id=user.id, is_read=0)
-        count = Notice.count(to_user_id=user.id, is_read=0)
+        count = Notice.unread_count(user.id)
     return ResultPageSchema(  # type: ignore
         page=params.page,
         count=params.count,
@@ -42,30 +40,58 @@ def get_all_message(params: NoticeSchema) -> dict[str, Any]:
 @login_required
 def notice_is_read(id: int) -> dict[str, str]:
     user = current_user.get()
-    notice = Notice.get_model_by_id(id)
-    if notice is None:
-        raise ParameterError(message="消息不存在")
-    if notice.to_user_id != user.id:
-        raise Forbidden(message="只能已读自己的消息")
-    if notice.is_read:
-        raise ParameterError(message="通知已读")
-    notice.is_read = 1
-    notice.save()
+    # 只会更新属于自己的未读消息
+    if not Notice.mark_read(user.id, [id]):
+        raise ParameterError(message="消息不存在或已读")
     return Updated(message="已读").to_dict()
 
 
+@bp.put("/read")
+@login_required
+@body(NoticeReadSchema)
+def notice_batch_is_read(body: NoticeReadSchema) -> dict[str, str]:
+    """批量已读."""
+    user = current_user.get()
+    count = Notice.mark_read(user.id, body.ids)
+    return Updated(message=f"已读 {count} 条").to_dict()
+
+
 @bp.put("")
 @login_required
 def notice_all_is_read() -> dict[str, str]:
     user = current_user.get()
-    with session:
-        session.execute(
-            update(Notice)
-            .where(
-                Notice.to_user_id == user.id,
-                Notice.is_read == 0,
-            )
-            .values(is_read=1)
-        )
-        session.commit()
+    Notice.mark_read(user.id)
     return Updated(message="已读所有").to_dict()
+
+
+@bp.get("/unread")
+@login_required
+def get_unread_count() -> dict[str, int]:
+    """未读消息数量, 客户端建立 websocket 连接时获取一次, 之后随新消息推送."""
+    user = current_user.get()
+    return {"unread": Notice.unread_count(user.id)}
+
+
+@bp.get("/broadcast")
+@login_required
+@parameter(PageSchema)
+def get_broadcasts(params: PageSchema) -> dict[str, Any]:
+    """全员消息."""
+    user = current_user.get()
+    return ResultPageSchema(  # type: ignore
+        page=params.page,
+        count=params.count,
+        total=NoticeBroadcast.count_for_user(user),
+        items=NoticeBroadcast.get_for_user(user, params.page, params.count),
+    ).dict()
+
+
+@bp.put("/broadcast/<int:id>")
+@login_required
+def broadcast_is_read(id: int) -> dict[str, str]:
+    user = current_user.get()
+    if NoticeBroadcast.get_model_by_id(id) is None:
+        raise ParameterError(message="消息不存在")
+    if not NoticeBroadcast.mark_read(user.id, id):
+        raise ParameterError(message="通知已读")
+    return Updated(message="已读").to_dict()
@@ -6,7 +6,7 @@ from src.common.db import session
 from src.util.exception import Created, Deleted, Forbidden, ParameterError, Success, Unautorization, Updated
 from src.util.validation import body, parameter
 
-from app.model.post import Category, Post, PostLike, PostTag, Tag
+from app.model.post import Category, Post, PostLike, PostTag, Tag, category_dict, tag_index
 from app.schema.admin import CategoryCreateSchema
 from app.schema.common import ResultPageSchema
 from app.schema.post import (
@@ -29,9 +29,7 @@ def get_posts(params: PostSchema) -> ResponseValue:
     """分页获取文章列表."""
     user = current_user.get()
 
-    statement = select(Post).order_by(-Post.create_time)
-    if params.category_id:
-        statement = statement.where(Post.category_id == params.category_id)
+    statement = Post.select_latest(params.category_id)
     if current_user is None:
         statement = statement.where(Post.publish < 2)
     else:
@@ -40,14 +38,15 @@ def get_posts(params: PostSchema) -> ResponseValue:
     statement = statement.offset(params.count * params.page).limit(params.count)
     with session:
         result = session.scalars(statement).all()
+        tags = Post.tags_of([item.id for item in result])
         res = []
         for item in result:
             data = item.to_dict()
-            data["tags"] = item.tags
+            data["tags"] = tags[item.id]
             data["category"] = item.category
             data["user"] = item.user
             res.append(data)
-        return ResultPageSchema(  # type:ignore
+        return ResultPageSchema(  # type: ignore
             page=params.page,
             count=params.count,
             total=0,  # TODO 获得对应范围的文章数量
@@ -141,7 +140,8 @@ def update_post(body: PostCreateSchema, id: int) -> ResponseValue:
     category = Category.get_model_by_id(body.category_id)
     if category is None:
         raise ParameterError(message="分类不存在")
-    post.update(body.dict())
+    post.update(body.dict(exclude={"tags"}))
+    post.set_tags(body.tags)
     return Updated(message="修改文章成功").to_dict()
 
 
@@ -287,22 +287,19 @@ def get_category(params: CategorySchema) -> ResponseValue:
 @bp.get("/category/all")
 def get_category_all() -> ResponseValue:
     """获取所有分类(不分页)."""
-    with session:
-        res = session.scalars(select(Category.id, Category.name)).all()
+    res = [{"id": item["id"], "name": item["name"]} for item in category_dict.all()]
 
     return {
         "items": res,
-        "total": Category.count(),
+        "total": len(res),
     }
 
 
 @bp.get("/tag/search")
 @parameter(TagSearchSchema)
 def search_tag(params: TagSearchSchema) -> ResponseValue:
-    """实时搜索, 返回10条."""
-    with session:
-        res = session.scalars(select(Tag.id, Tag.name).where((Tag.name).like(f"%{params.q}%")).limit(10)).all()
-        return list(res)
+    """实时搜索, 返回10条, 前缀匹配在前, 按文章数排序."""
+    return tag_index.complete(params.q, limit=10)
 
 
 @bp.post("/tag")
@@ -1,7 +1,9 @@
 from flask import Flask
 
+from .db import db_cli
 from .demo import demo
 
 
 def regsiter_cli(app: Flask) -> None:
     app.cli.add_command(demo)
+    app.cli.add_command(db_cli)
@@ -0,0 +1,48 @@
+from click import echo, option
+from flask.cli import AppGroup
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex, CreateTable
+from src.app.model import comment, notice, post, user  # noqa: F401 注册所有模型到 metadata
+from src.app.model.base import BaseModel
+from src.common.db import db
+
+db_cli = AppGroup("db")
+
+
+@db_cli.command("create-table")
+@option("--dry-run", is_flag=True, help="只打印建表语句, 不执行")
+def create_table(dry_run: bool) -> None:
+    """创建数据库中缺失的表及其索引, 已存在的表跳过, 可重复执行; 已存在的表缺失的索引由 create-index 创建."""
+    inspector = inspect(db.engine)
+    for table in BaseModel.metadata.sorted_tables:
+        if inspector.has_table(table.name):
+            continue
+        echo(f"create table {table.name}")
+        if dry_run:
+            echo(f"{str(CreateTable(table).compile(db.engine)).strip()};")
+            for index in table.indexes:
+                echo(f"{CreateIndex(index).compile(db.engine)};")
+        else:
+            table.create(db.engine)
+
+
+@db_cli.command("create-index")
+@option("--dry-run", is_flag=True, help="只打印, 不执行")
+def create_index(dry_run: bool) -> None:
+    """根据模型定义创建数据库中缺失的索引, 已存在的跳过, 可重复执行."""
+    inspector = inspect(db.engine)
+    for table in BaseModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        # 部分数据库中表达式索引等没有名称
+        existed = {index["name"] for index in inspector.get_indexes(table.name) if index["name"] is not None}
+        defined = {index.name for index in table.indexes}
+        for index in table.indexes:
+            if index.name in existed:
+                continue
+            echo(f"create index {table.name}.{index.name}")
+            if not dry_run:
+                index.create(db.engine)
+        for name in sorted(existed - defined):
+            # 可能是被复合索引取代的旧索引, 确认后手动删除
+            echo(f"index not in model: {table.name}.{name}")
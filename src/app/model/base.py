@@ -8,10 +8,13 @@ from typing import TYPE_CHECKING, Annotated, Any, Self
 from sqlalchemy import BigInteger, func, select
 from sqlalchemy.orm import DeclarativeBase, Mapped, MappedAsDataclass, declared_attr, mapped_column
 from src.common.db import session
+from src.common.redis import redis
 
 if TYPE_CHECKING:
     from collections.abc import Sequence
 
+    from sqlalchemy import Select
+
 
 class Declarative(MappedAsDataclass, DeclarativeBase):
     """BaseModel 创建时(也就是 DeclarativeBase 子类化时)会创建 register(包括 metadata 和 mapper).
@@ -37,7 +40,7 @@ class BaseModel(Declarative):
     @classmethod
     def __tablename__(cls) -> str:
         # 将大写字母替换为下划线加小写字母
-        result = re.sub(r"[A-Z]", lambda x: f"_{x.group(0).lower()!r}", cls.__tablename__)
+        result = re.sub(r"[A-Z]", lambda x: f"_{x.group(0).lower()}", cls.__name__)
         # 去掉首个下划线
         result = result.lstrip("_")
         return result
@@ -64,11 +67,31 @@ class BaseModel(Declarative):
         with session:
             return session.scalars(select(cls).filter_by(**kwargs)).first()
 
+    @classmethod
+    def exists(cls, id: int) -> bool:
+        """Row 是否存在, 结果缓存在 redis 中, 不存在的结果缓存时间较短."""
+        key = f"exists:{cls.__tablename__}:{id}"
+        cached = redis.get(key)
+        if cached is not None:
+            return cached == "1"
+        existed = cls.get_model_by_id(id) is not None
+        redis.set(key, int(existed), ex=3600 if existed else 60)
+        return existed
+
+    @classmethod
+    def clear_exists(cls, id: int) -> None:
+        """删除 row 后清除存在性缓存."""
+        redis.delete(f"exists:{cls.__tablename__}:{id}")
+
+    @classmethod
+    def select_all(cls, page: int = 0, count: int = 10, **kwargs: Any) -> Select[tuple[Self]]:
+        """get_all 的查询语句."""
+        return select(cls).filter_by(**kwargs).offset(page * count).limit(count)
+
     @classmethod
     def get_all(cls, page: int = 0, count: int = 10, **kwargs: Any) -> Sequence[Self]:
         with session:
-            statement = select(cls).filter_by(**kwargs).offset(page * count).limit(count)
-            return session.scalars(statement).all()
+            return session.scalars(cls.select_all(page, count, **kwargs)).all()
 
     @classmethod
     def count(cls, **kwargs: Any) -> int:
@@ -84,7 +107,3 @@ class BaseModel(Declarative):
 
     def to_dict(self) -> dict[str, Any]:
         return asdict(self)
-
-
-class User(BaseModel):
-    pass
@@ -1,6 +1,37 @@
-from sqlalchemy import String
-from sqlalchemy.orm import Mapped, mapped_column
+from collections import Counter
+from collections.abc import Sequence
+from datetime import timedelta
+from typing import TYPE_CHECKING, Any, ClassVar
+from uuid import uuid4
+
+import orjson
+from sqlalchemy import ColumnElement, Dialect, Index, Select, String, func, select, update
+from sqlalchemy.orm import Mapped, aliased, mapped_column
 from src.app.model.base import BaseModel, T_create_time, T_id
+from src.common.cache import BaseNode, JSONSerializer, cache
+from src.common.db import session
+from src.common.redis import redis, storage
+from structlog import getLogger
+from wakaq.exceptions import SoftTimeout
+
+from .post import Post
+
+if TYPE_CHECKING:
+    from redis.client import Pipeline
+    from structlog.stdlib import BoundLogger
+
+logger: "BoundLogger" = getLogger("comment")
+
+INGEST_KEY = "comment:ingest"
+# 已取出但还没有提交的评论, 提交后才删除; 任务被终止时由下一次任务放回 INGEST_KEY
+INGEST_PROCESSING_KEY = "comment:ingest:processing"
+# 写入失败的评论, 下一次写入任务开始时放回 INGEST_KEY
+INGEST_RETRY_KEY = "comment:ingest:retry"
+# 失败次数达到 INGEST_MAX_ATTEMPTS 的评论, 需要人工处理
+INGEST_DEAD_KEY = "comment:ingest:dead"
+INGEST_MAX_ATTEMPTS = 5
+PENDING_KEY = "comment:pending:{}"
+PENDING_TTL = 60 * 60
 
 
 class Comment(BaseModel):
@@ -20,9 +51,299 @@ class Comment(BaseModel):
     create_time: Mapped[T_create_time] = mapped_column(default=None, comment="创建时间")
     is_deleted: Mapped[int] = mapped_column(default=0, comment="是否删除,0-未删除, 1-已删除")
 
+    __table_args__ = (
+        # 文章的根评论分页: post_id = ? AND root_id = 0
+        Index("post_root_time", "post_id", "root_id", "create_time"),
+        # 根评论的回复分页: root_id = ?
+        Index("root_time", "root_id", "create_time"),
+    )
+
+    def remove(self) -> None:
+        """删除评论, 同一事务中原子地扣减文章评论数和根评论回复数."""
+        with session:
+            session.delete(self)
+            session.execute(update(Post).where(Post.id == self.post_id).values(comment_count=Post.comment_count - 1))
+            if self.root_id > 0:
+                session.execute(
+                    update(Comment).where(Comment.id == self.root_id).values(replay_count=Comment.replay_count - 1)
+                )
+            session.commit()
+        CommentPage.invalidate(self.post_id)
+        Comment.clear_exists(self.id)
+
+    @classmethod
+    def enqueue(cls, post_id: int, user_id: int, content: str, root_id: int = 0, parent_id: int = 0) -> str:
+        """放入写入队列, 由任务队列批量写入, 返回临时 id."""
+        provisional_id = uuid4().hex
+        data = {
+            "provisional_id": provisional_id,
+            "post_id": post_id,
+            "user_id": user_id,
+            "content": content,
+            "root_id": root_id,
+            "parent_id": parent_id,
+        }
+        redis.rpush(INGEST_KEY, orjson.dumps(data))
+        return provisional_id
+
+    @classmethod
+    def pending_status(cls, provisional_id: str) -> int | None:
+        """临时 id 对应的评论 id: None-处理中, 0-已丢弃(文章或评论不存在), 其他-已写入."""
+        res = redis.get(PENDING_KEY.format(provisional_id))
+        return None if res is None else int(res)
+
+    @classmethod
+    def ingest(cls, batch_size: int = 500) -> int:
+        """从写入队列取出一批评论, 一个事务中写入并累加计数, 返回取出的数量.
+
+        批量写入失败时逐条重试, 仍然失败的评论放入重试队列, 由下一次任务重新入队,
+        失败 INGEST_MAX_ATTEMPTS 次后放入死信队列等待人工处理, 不影响同批的其他评论.
+        同一时间只能有一个任务调用, 见 ingest_comments.
+        """
+        raw = cls._take(batch_size)
+        if not raw:
+            return 0
+        items: list[dict[str, Any]] = [orjson.loads(item) for item in raw]
+        failed: list[dict[str, Any]] = []
+        try:
+            results = cls._write(items)
+        except SoftTimeout:
+            # 评论留在处理中列表, 由重试的任务放回写入队列
+            raise
+        except Exception:
+            logger.warning("ingest comments failed, retry one by one", count=len(items), exc_info=True)
+            results, failed = cls._write_each(items)
+        # 写入结果和移出处理中列表在一个事务中生效
+        pipe = redis.pipeline()
+        for item in failed:
+            cls._write_failed(item, pipe)
+        for provisional_id, comment_id in results.items():
+            pipe.set(PENDING_KEY.format(provisional_id), comment_id, ex=PENDING_TTL)
+        for value in raw:
+            pipe.lrem(INGEST_PROCESSING_KEY, 1, value)
+        pipe.execute()
+        for post_id in {item["post_id"] for item in items if results.get(item["provisional_id"])}:
+            CommentPage.invalidate(post_id)
+        return len(items)
+
+    @classmethod
+    def _take(cls, batch_size: int) -> list[str]:
+        """从写入队列取出最多 batch_size 条评论, 同时移入处理中列表."""
+        size = min(batch_size, redis.llen(INGEST_KEY))
+        if not size:
+            return []
+        pipe = redis.pipeline()
+        for _ in range(size):
+            pipe.lmove(INGEST_KEY, INGEST_PROCESSING_KEY, "LEFT", "RIGHT")
+        return [item for item in pipe.execute() if item is not None]
+
+    @classmethod
+    def _write(cls, items: list[dict[str, Any]]) -> dict[str, int]:
+        """一个事务中写入评论并累加计数, 返回 {临时 id: 评论 id}, 文章或根/父评论不存在时为 0.
+
+        入队前只做了缓存校验, 这里再用两条 IN 查询确认文章和根/父评论存在.
+        """
+        with session:
+            post_ids = set(
+                session.scalars(select(Post.id).where(Post.id.in_({item["post_id"] for item in items}))).all()
+            )
+            comment_ids = {item["root_id"] for item in items} | {item["parent_id"] for item in items}
+            comment_ids = set(session.scalars(select(cls.id).where(cls.id.in_(comment_ids - {0}))).all())
+            comment_ids.add(0)
+            accepted = [
+                item
+                for item in items
+                if item["post_id"] in post_ids and item["root_id"] in comment_ids and item["parent_id"] in comment_ids
+            ]
+            comments = [
+                cls(
+                    post_id=item["post_id"],
+                    user_id=item["user_id"],
+                    root_id=item["root_id"],
+                    parent_id=item["parent_id"],
+                    content=item["content"],
+                )
+                for item in accepted
+            ]
+            session.add_all(comments)
+            post_counts = Counter(comment.post_id for comment in comments)
+            root_counts = Counter(comment.root_id for comment in comments if comment.root_id > 0)
+            for post_id, count in post_counts.items():
+                session.execute(update(Post).where(Post.id == post_id).values(comment_count=Post.comment_count + count))
+            for root_id, count in root_counts.items():
+                session.execute(update(cls).where(cls.id == root_id).values(replay_count=cls.replay_count + count))
+            session.flush()
+            res = {item["provisional_id"]: 0 for item in items}
+            res.update({item["provisional_id"]: comment.id for item, comment in zip(accepted, comments, strict=True)})
+            session.commit()
+        return res
+
+    @classmethod
+    def _write_each(cls, items: list[dict[str, Any]]) -> tuple[dict[str, int], list[dict[str, Any]]]:
+        """逐条写入, 返回 ({临时 id: 评论 id}, 失败的评论)."""
+        results: dict[str, int] = {}
+        failed: list[dict[str, Any]] = []
+        for item in items:
+            try:
+                results.update(cls._write([item]))
+            except SoftTimeout:
+                raise
+            except Exception:
+                logger.warning("ingest comment failed", item=item, exc_info=True)
+                failed.append(item)
+        return results, failed
+
+    @classmethod
+    def _write_failed(cls, item: dict[str, Any], pipe: "Pipeline[str]") -> None:
+        """在 pipe 中把失败的评论放入重试队列, 次数用完时放入死信队列."""
+        item["attempts"] = item.get("attempts", 0) + 1
+        if item["attempts"] < INGEST_MAX_ATTEMPTS:
+            pipe.rpush(INGEST_RETRY_KEY, orjson.dumps(item))
+            return
+        logger.error("ingest comment dead", item=item)
+        pipe.rpush(INGEST_DEAD_KEY, orjson.dumps(item))
+        # 不再处理, 客户端按已丢弃处理
+        pipe.set(PENDING_KEY.format(item["provisional_id"]), 0, ex=PENDING_TTL)
+
+    @classmethod
+    def requeue_failed(cls) -> int:
+        """把被终止的任务未提交的评论放回写入队列头部, 重试队列中的评论放回尾部, 返回数量.
+
+        只能在没有其他任务写入时调用. 任务在提交后、更新 Redis 前被终止时, 这批评论会被重复写入.
+        """
+        count = 0
+        while redis.lmove(INGEST_PROCESSING_KEY, INGEST_KEY, "RIGHT", "LEFT") is not None:
+            count += 1
+        while redis.lmove(INGEST_RETRY_KEY, INGEST_KEY, "LEFT", "RIGHT") is not None:
+            count += 1
+        return count
+
+    # 数据库是否支持窗口函数, 首次查询时根据数据库版本确定
+    _window_supported: ClassVar[bool | None] = None
+
+    @classmethod
+    def get_top_replies(cls, root_ids: Sequence[int], limit: int = 3) -> dict[int, list["Comment"]]:
+        """一次查询获得每个根评论最早的 limit 条回复, 返回 {root_id: [回复]}."""
+        res: dict[int, list[Comment]] = {root_id: [] for root_id in root_ids}
+        if not root_ids:
+            return res
+        if cls._window_supported is None:
+            with session:
+                cls._window_supported = supports_window_function(session.connection().dialect)
+        replies: Sequence[Comment]
+        if cls._window_supported:
+            replies = cls._top_replies_window(root_ids, limit)
+        else:
+            replies = cls._top_replies_grouped(root_ids, limit)
+        for reply in replies:
+            res[reply.root_id].append(reply)
+        return res
+
+    @classmethod
+    def select_roots(cls, post_id: int, page: int = 0, count: int = 10) -> Select[tuple["Comment"]]:
+        """文章的根评论, 按时间排序."""
+        return (
+            select(cls)
+            .where(cls.post_id == post_id, cls.root_id == 0)
+            .order_by(cls.create_time, cls.id)
+            .offset(page * count)
+            .limit(count)
+        )
+
+    @classmethod
+    def select_top_replies(cls, root_ids: Sequence[int], limit: int) -> Select[tuple["Comment"]]:
+        """每个根评论最早的 limit 条回复, 使用窗口函数."""
+        # ROW_NUMBER() OVER (PARTITION BY root_id ORDER BY create_time, id), row_number/rank 是 MySQL 8 的保留字
+        reply_rank = (
+            func.row_number().over(partition_by=cls.root_id, order_by=(cls.create_time, cls.id)).label("reply_rank")
+        )
+        subquery = select(cls, reply_rank).where(cls.root_id.in_(root_ids)).subquery()
+        reply = aliased(cls, subquery)
+        rank_column: ColumnElement[int] = subquery.c["reply_rank"]
+        return select(reply).where(rank_column <= limit).order_by(reply.root_id, rank_column)
+
+    @classmethod
+    def select_replies(cls, root_ids: Sequence[int]) -> Select[tuple["Comment"]]:
+        """根评论的所有回复, 按根评论和时间排序."""
+        return select(cls).where(cls.root_id.in_(root_ids)).order_by(cls.root_id, cls.create_time, cls.id)
+
+    @classmethod
+    def _top_replies_window(cls, root_ids: Sequence[int], limit: int) -> Sequence["Comment"]:
+        with session:
+            return session.scalars(cls.select_top_replies(root_ids, limit)).all()
+
+    @classmethod
+    def _top_replies_grouped(cls, root_ids: Sequence[int], limit: int) -> list["Comment"]:
+        """不支持窗口函数时: 一次 IN 查询所有回复, 在 Python 中按根评论截取."""
+        counts: dict[int, int] = {}
+        res: list[Comment] = []
+        with session:
+            for reply in session.scalars(cls.select_replies(root_ids)):
+                counts[reply.root_id] = counts.get(reply.root_id, 0) + 1
+                if counts[reply.root_id] <= limit:
+                    res.append(reply)
+        return res
+
+
+def supports_window_function(dialect: Dialect) -> bool:
+    """MySQL 8.0+, MariaDB 10.2+, SQLite 3.25+ 支持窗口函数, PostgreSQL 都支持."""
+    version = dialect.server_version_info or ()
+    if dialect.name in ("mysql", "mariadb"):
+        return version >= ((10, 2) if getattr(dialect, "is_mariadb", False) else (8, 0))
+    if dialect.name == "sqlite":
+        return version >= (3, 25)
+    return True
+
 
 class CommentLike(BaseModel):
     id: Mapped[T_id] = mapped_column(init=False)
     user_id: Mapped[int] = mapped_column()
     comment_id: Mapped[int] = mapped_column()
     create_time: Mapped[T_create_time] = mapped_column(default=None, comment="创建时间")
+
+
+class CommentPage(BaseNode):
+    """文章评论分页缓存(根评论及其前 3 条回复).
+
+    同一篇文章的所有分页在一个命名空间下, 评论增删改时递增命名空间版本号使其全部失效.
+    """
+
+    post_id: int
+    page: int = 0
+    count: int = 10
+    total: int = 0
+    items: list[dict[str, Any]] = []
+
+    def key(self) -> str:
+        return f"{self.page}:{self.count}"
+
+    def namespace(self) -> str:
+        return f"post:{self.post_id}"
+
+    def load(self) -> Any:
+        with session:
+            comments = session.scalars(Comment.select_roots(self.post_id, self.page, self.count)).all()
+        # 一次查询获得本页所有根评论的前 3 条回复
+        replays = Comment.get_top_replies([comment.id for comment in comments], limit=3)
+        items = []
+        for comment in comments:
+            item = comment.to_dict()
+            item["replay"] = [replay.to_dict() for replay in replays[comment.id]]
+            items.append(item)
+        return {
+            "post_id": self.post_id,
+            "page": self.page,
+            "count": self.count,
+            "total": Comment.count(post_id=self.post_id, root_id=0),
+            "items": items,
+        }
+
+    @classmethod
+    def invalidate(cls, post_id: int) -> None:
+        cache.expire(cls(post_id=post_id))
+
+    class Meta:
+        prefix = "comment:page:"
+        ttl = timedelta(minutes=10)
+        storage = storage
+        serializer = JSONSerializer()
@@ -1,12 +1,261 @@
-from sqlalchemy import String
+from collections.abc import Iterable, Sequence
+from typing import Any, Self
+
+from sqlalchemy import Index, Select, String, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Mapped, mapped_column
 from src.app.model.base import BaseModel, T_create_time, T_id
+from src.common.db import session
+from src.common.redis import redis
+from src.common.sock import sock
+
+from .user import User
+
+UNREAD_KEY = "notice:unread:{}"
+UNREAD_TTL = 60 * 60 * 24
+FANOUT_KEY = "notice:fanout:{}"
+FANOUT_TTL = 60 * 60 * 24 * 7
+# 缓存存在时才增减, 避免缓存过期后从 0 开始计数; 不存在时由 unread_count 从数据库加载
+_incr_if_exists = redis.register_script(
+    """
+    if redis.call('exists', KEYS[1]) == 0 then return false end
+    local value = redis.call('incrby', KEYS[1], ARGV[1])
+    if value < 0 then
+        redis.call('set', KEYS[1], 0, 'KEEPTTL')
+        return 0
+    end
+    return value
+    """
+)
 
 
 class Notice(BaseModel):
     id: Mapped[T_id] = mapped_column(init=False)
     content: Mapped[str] = mapped_column(String(200), comment="内容")
-    to_user_id: Mapped[int] = mapped_column(index=True, comment="接收用户 id")
+    to_user_id: Mapped[int] = mapped_column(comment="接收用户 id")
     from_user_id: Mapped[int] = mapped_column(default=0, index=True, comment="发送消息用户id,0-系统")
     is_read: Mapped[int] = mapped_column(default=0, comment="是否已读: 0-未读, 1-已读")
     create_time: Mapped[T_create_time] = mapped_column(default=None, comment="创建时间")
+
+    # 覆盖 to_user_id = ? [AND is_read = ?] 的查询、计数和已读更新, 按 id(即时间)排序
+    __table_args__ = (Index("to_user_read_id", "to_user_id", "is_read", "id"),)
+
+    @classmethod
+    def send(cls, to_user_id: int, content: str, from_user_id: int = 0) -> Self:
+        """创建消息并实时推送给接收用户的所有 websocket 连接."""
+        notice = cls(content=content, to_user_id=to_user_id, from_user_id=from_user_id).save()
+        unread = cls.incr_unread(to_user_id, 1)
+        sock.send_one(to_user_id, {"type": "notice", "message": {"notice": notice.to_dict(), "unread": unread}})
+        return notice
+
+    @classmethod
+    def select_all(cls, page: int = 0, count: int = 10, **kwargs: Any) -> Select[tuple[Self]]:
+        """最新的消息在前."""
+        return super().select_all(page, count, **kwargs).order_by(cls.id.desc())
+
+    @classmethod
+    def unread_count(cls, user_id: int) -> int:
+        """未读消息数量, 优先从缓存中获取."""
+        key = UNREAD_KEY.format(user_id)
+        cached = redis.get(key)
+        if cached is not None:
+            return int(cached)
+        count = cls.count(to_user_id=user_id, is_read=0)
+        # 并发加载时以先写入的为准, 之后的增减都基于它
+        redis.set(key, count, ex=UNREAD_TTL, nx=True)
+        return count
+
+    @classmethod
+    def incr_unread(cls, user_id: int, amount: int) -> int:
+        """原子地增减未读数量, 返回增减后的数量."""
+        unread = _incr_if_exists(keys=[UNREAD_KEY.format(user_id)], args=[amount])
+        if unread is None:
+            return cls.unread_count(user_id)
+        return int(unread)
+
+    @classmethod
+    def mark_read(cls, user_id: int, ids: Iterable[int] | None = None) -> int:
+        """一条 UPDATE 将消息标为已读, ids 为 None 时标记所有消息, 返回实际标记的数量.
+
+        只统计由未读变为已读的行, 并发标记同一条消息时只会扣减一次未读数量.
+        """
+        statement = update(cls).where(cls.to_user_id == user_id, cls.is_read == 0)
+        if ids is not None:
+            statement = statement.where(cls.id.in_(list(ids)))
+        with session:
+            result = session.execute(statement.values(is_read=1))
+            session.commit()
+        count: int = result.rowcount  # type: ignore[attr-defined]
+        if count:
+            cls.incr_unread(user_id, -count)
+        return count
+
+    @classmethod
+    def bulk_send(cls, to_user_ids: Sequence[int], content: str, from_user_id: int = 0, push: bool = True) -> int:
+        """一条多行 INSERT 给一批用户发送相同的消息, 返回发送数量.
+
+        push 时与 send 一样给每个用户推送消息和增加后的未读数量; 多行 INSERT 拿不到每行的 id, 推送的消息不带 id.
+        """
+        if not to_user_ids:
+            return 0
+        rows: list[dict[str, Any]] = [
+            {"content": content, "to_user_id": user_id, "from_user_id": from_user_id} for user_id in to_user_ids
+        ]
+        with session:
+            session.execute(insert(cls).values(rows))
+            session.commit()
+        pipe = redis.pipeline(transaction=False)
+        for user_id in to_user_ids:
+            _incr_if_exists(keys=[UNREAD_KEY.format(user_id)], args=[1], client=pipe)
+        unreads = pipe.execute()
+        if push:
+            for row, cached in zip(rows, unreads, strict=True):
+                user_id = row["to_user_id"]
+                notice = {**row, "is_read": 0}
+                # 缓存不存在时从数据库加载, 已包含刚插入的消息
+                unread = int(cached) if cached is not None else cls.unread_count(user_id)
+                sock.send_one(user_id, {"type": "notice", "message": {"notice": notice, "unread": unread}})
+        return len(rows)
+
+    @classmethod
+    def fanout(cls, job_id: str, content: str, from_user_id: int = 0, chunk_size: int = 5000) -> None:
+        """给所有用户发送系统消息(写扩散), 按 id 分批读取用户并批量插入.
+
+        进度保存在 hash `notice:fanout:<job_id>` 中: total, done, last_id, status.
+        任务重试时从 last_id 继续; 插入成功但进度未保存时重试会重复发送最后一批.
+        """
+        key = FANOUT_KEY.format(job_id)
+        progress = redis.hgetall(key)
+        if progress.get("status") == "done":
+            return
+        last_id = int(progress.get("last_id", 0))
+        if "total" not in progress:
+            redis.hset(key, mapping={"total": User.count(), "done": 0, "last_id": 0, "status": "running"})
+            redis.expire(key, FANOUT_TTL)
+        while True:
+            with session:
+                user_ids: Sequence[int] = session.scalars(
+                    select(User.id).where(User.id > last_id).order_by(User.id).limit(chunk_size)
+                ).all()
+            if not user_ids:
+                break
+            # 所有用户都会收到, 最后统一广播一次, 不逐个推送
+            cls.bulk_send(user_ids, content, from_user_id, push=False)
+            last_id = user_ids[-1]
+            pipe = redis.pipeline()
+            pipe.hincrby(key, "done", len(user_ids))
+            pipe.hset(key, "last_id", last_id)
+            pipe.execute()
+        redis.hset(key, "status", "done")
+        sock.broadcast({"type": "notice", "message": {"notice": {"content": content}}})
+
+    @classmethod
+    def fanout_progress(cls, job_id: str) -> dict[str, Any] | None:
+        progress = redis.hgetall(FANOUT_KEY.format(job_id))
+        if not progress:
+            return None
+        return {
+            "job_id": job_id,
+            "status": progress["status"],
+            "total": int(progress["total"]),
+            "done": int(progress["done"]),
+        }
+
+    @classmethod
+    def reconcile_unread(cls, user_ids: Iterable[int] | None = None, chunk_size: int = 500) -> int:
+        """用数据库校对缓存的未读数量, 默认校对所有已缓存的用户, 返回校对的用户数.
+
+        计数与 send/mark_read 之间仍可能有极短的竞争窗口, 由下次校对修正.
+        """
+        if user_ids is None:
+            prefix = UNREAD_KEY.format("")
+            user_ids = (int(key.removeprefix(prefix)) for key in redis.scan_iter(match=f"{prefix}*", count=1000))
+        total = 0
+        chunk: list[int] = []
+        for user_id in user_ids:
+            chunk.append(user_id)
+            if len(chunk) >= chunk_size:
+                total += cls._reconcile_chunk(chunk)
+                chunk = []
+        if chunk:
+            total += cls._reconcile_chunk(chunk)
+        return total
+
+    @classmethod
+    def _reconcile_chunk(cls, user_ids: list[int]) -> int:
+        with session:
+            rows: Sequence[tuple[int, int]] = (
+                session.execute(
+                    select(cls.to_user_id, func.count(cls.id))
+                    .where(cls.to_user_id.in_(user_ids), cls.is_read == 0)
+                    .group_by(cls.to_user_id)
+                )
+                .tuples()
+                .all()
+            )
+        counts: dict[int, int] = dict.fromkeys(user_ids, 0)
+        counts.update(rows)
+        pipe = redis.pipeline(transaction=False)
+        for user_id, unread in counts.items():
+            pipe.set(UNREAD_KEY.format(user_id), unread, ex=UNREAD_TTL)
+        pipe.execute()
+        return len(counts)
+
+
+class NoticeBroadcast(BaseModel):
+    """全员消息(读扩散): 只写一行, 用户已读时才写入 NoticeBroadcastRead."""
+
+    id: Mapped[T_id] = mapped_column(init=False)
+    content: Mapped[str] = mapped_column(String(200), comment="内容")
+    from_user_id: Mapped[int] = mapped_column(default=0, comment="发送消息用户id,0-系统")
+    create_time: Mapped[T_create_time] = mapped_column(default=None, comment="创建时间")
+
+    @classmethod
+    def send(cls, content: str, from_user_id: int = 0) -> Self:
+        broadcast = cls(content=content, from_user_id=from_user_id).save()
+        sock.broadcast({"type": "broadcast", "message": {"notice": broadcast.to_dict()}})
+        return broadcast
+
+    @classmethod
+    def get_for_user(cls, user: User, page: int = 0, count: int = 10) -> list[dict[str, Any]]:
+        """用户注册后的全员消息, 带已读标记."""
+        with session:
+            broadcasts: Sequence[NoticeBroadcast] = session.scalars(
+                select(cls)
+                .where(cls.create_time >= user.create_time)
+                .order_by(cls.id.desc())
+                .offset(page * count)
+                .limit(count)
+            ).all()
+            read_ids: set[int] = set(
+                session.scalars(
+                    select(NoticeBroadcastRead.broadcast_id).where(
+                        NoticeBroadcastRead.user_id == user.id,
+                        NoticeBroadcastRead.broadcast_id.in_([item.id for item in broadcasts]),
+                    )
+                ).all()
+            )
+        return [{**item.to_dict(), "is_read": int(item.id in read_ids)} for item in broadcasts]
+
+    @classmethod
+    def count_for_user(cls, user: User) -> int:
+        with session:
+            return session.scalar(select(func.count(cls.id)).where(cls.create_time >= user.create_time)) or 0
+
+    @classmethod
+    def mark_read(cls, user_id: int, broadcast_id: int) -> bool:
+        """写入已读标记, 返回是否为首次已读."""
+        try:
+            NoticeBroadcastRead(broadcast_id=broadcast_id, user_id=user_id).save()
+        except IntegrityError:
+            return False
+        return True
+
+
+class NoticeBroadcastRead(BaseModel):
+    id: Mapped[T_id] = mapped_column(init=False)
+    broadcast_id: Mapped[int] = mapped_column(comment="全员消息 id")
+    user_id: Mapped[int] = mapped_column(comment="已读用户 id")
+    create_time: Mapped[T_create_time] = mapped_column(default=None, comment="已读时间")
+
+    __table_args__ = (Index("user_broadcast", "user_id", "broadcast_id", unique=True),)
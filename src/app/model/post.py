@@ -1,9 +1,13 @@
+from collections import Counter
+from collections.abc import Iterable, Mapping, Sequence
 from typing import Any
 
-from sqlalchemy import TEXT, Index, String, delete, select
-from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import TEXT, Index, Select, String, delete, event, func, select
+from sqlalchemy.orm import Mapped, Session, mapped_column, object_session
 from src.app.model.base import BaseModel, T_create_time, T_id, T_update_time
+from src.common.autocomplete import Autocomplete
 from src.common.db import session
+from src.common.dictionary import Dictionary
 
 from .user import User
 
@@ -19,7 +23,7 @@ class Category(BaseModel):
     update_time: Mapped[T_update_time] = mapped_column(default=None, comment="更新时间")
     is_deleted: Mapped[int] = mapped_column(default=0, comment="是否删除, 0-未删除, 1-已删除")
 
-    __tableargs__ = (Index("name_del", "name", "is_deleted", unique=True),)
+    __table_args__ = (Index("name_del", "name", "is_deleted", unique=True),)
 
 
 class Tag(BaseModel):
@@ -34,6 +38,97 @@ class PostTag(BaseModel):
     tag_id: Mapped[int] = mapped_column(comment="tag id")
 
 
+def _load_tags() -> list[tuple[int, str, float]]:
+    """所有标签及其文章数(热度)."""
+    with session:
+        rows = session.execute(
+            select(Tag.id, Tag.name, func.count(PostTag.id))
+            .outerjoin(PostTag, PostTag.tag_id == Tag.id)
+            .group_by(Tag.id, Tag.name)
+        ).all()
+    return [(id, name, count) for id, name, count in rows]
+
+
+def _load_categories() -> list[dict[str, Any]]:
+    with session:
+        return [item.to_dict() for item in session.scalars(select(Category).order_by(Category.sort, Category.id))]
+
+
+def _load_tag_dict() -> list[dict[str, Any]]:
+    with session:
+        return [item.to_dict() for item in session.scalars(select(Tag))]
+
+
+# 分类和标签很少修改, 序列化文章时直接读取进程内的字典, 修改后通过 pub/sub 通知所有进程重新加载
+category_dict = Dictionary("category", _load_categories)
+category_dict.watch(Category)
+tag_dict = Dictionary("tag", _load_tag_dict)
+tag_dict.watch(Tag)
+
+# 标签自动补全, 按文章数排序
+tag_index = Autocomplete("tag:autocomplete", _load_tags)
+TAG_CHANGES_KEY = "tag_index_changes"
+
+
+def _tag_changes(db_session: Session) -> dict[str, Any]:
+    """记录本次事务中标签的变化, 提交后再更新自动补全索引."""
+    changes: dict[str, Any] = db_session.info.setdefault(
+        TAG_CHANGES_KEY, {"add": {}, "remove": set(), "incr": Counter()}
+    )
+    return changes
+
+
+@event.listens_for(Tag, "after_insert")
+@event.listens_for(Tag, "after_update")
+def _tag_saved(mapper: Any, connection: Any, target: Tag) -> None:
+    db_session = object_session(target)
+    if db_session is not None:
+        _tag_changes(db_session)["add"][target.id] = target.name
+
+
+@event.listens_for(Tag, "after_delete")
+def _tag_deleted(mapper: Any, connection: Any, target: Tag) -> None:
+    db_session = object_session(target)
+    if db_session is not None:
+        changes = _tag_changes(db_session)
+        changes["add"].pop(target.id, None)
+        changes["remove"].add(target.id)
+
+
+@event.listens_for(PostTag, "after_insert")
+def _post_tag_added(mapper: Any, connection: Any, target: PostTag) -> None:
+    db_session = object_session(target)
+    if db_session is not None:
+        _tag_changes(db_session)["incr"][target.tag_id] += 1
+
+
+@event.listens_for(PostTag, "after_delete")
+def _post_tag_deleted(mapper: Any, connection: Any, target: PostTag) -> None:
+    # 批量 DELETE 语句不会触发, 由定时任务重建修正
+    db_session = object_session(target)
+    if db_session is not None:
+        _tag_changes(db_session)["incr"][target.tag_id] -= 1
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_tag_changes(db_session: Session) -> None:
+    changes = db_session.info.pop(TAG_CHANGES_KEY, None)
+    if not changes:
+        return
+    for id, name in changes["add"].items():
+        tag_index.add(id, name)
+    for id in changes["remove"]:
+        tag_index.remove(id)
+    scores = {id: amount for id, amount in changes["incr"].items() if amount and id not in changes["remove"]}
+    if scores:
+        tag_index.incr(scores)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_tag_changes(db_session: Session) -> None:
+    db_session.info.pop(TAG_CHANGES_KEY, None)
+
+
 class PostLike(BaseModel):
     id: Mapped[T_id] = mapped_column(init=False)
     post_id: Mapped[int] = mapped_column(comment="文章 id")
@@ -62,28 +157,52 @@ class Post(BaseModel):
     like_count: Mapped[int] = mapped_column(default=0, comment="点赞量")
     comment_count: Mapped[int] = mapped_column(default=0, comment="评论数")
 
-    __tableargs__ = (Index("name", "name"), Index("status", "status"))
+    __table_args__ = (
+        Index("title", "title"),
+        Index("status", "status"),
+        # 分类下按时间倒序分页
+        Index("category_time", "category_id", "create_time"),
+    )
+
+    @classmethod
+    def select_latest(cls, category_id: int = 0) -> Select[tuple["Post"]]:
+        """按时间倒序的文章, category_id 为 0 时不限分类."""
+        statement = select(cls).order_by(cls.create_time.desc())
+        if category_id:
+            statement = statement.where(cls.category_id == category_id)
+        return statement
 
     @property
-    def tags(self) -> list[Tag]:
-        res = []
-        with session:
-            _tags = session.scalars(select(PostTag.tag_id).where(PostTag.post_id == self.id)).all()
-            for tag_id in _tags:
-                tag = Tag.get_model_by_id(tag_id)
-                if tag is not None:
-                    res.append(tag)
+    def tags(self) -> list[dict[str, Any]]:
+        return self.tags_of([self.id])[self.id]
 
+    @classmethod
+    def tags_of(cls, post_ids: list[int]) -> dict[int, list[dict[str, Any]]]:
+        """一次查询获得多篇文章的标签."""
+        res: dict[int, list[dict[str, Any]]] = {post_id: [] for post_id in post_ids}
+        if not post_ids:
+            return res
+        with session:
+            rows: Sequence[tuple[int, int]] = (
+                session.execute(
+                    select(PostTag.post_id, PostTag.tag_id).where(PostTag.post_id.in_(post_ids)).order_by(PostTag.id)
+                )
+                .tuples()
+                .all()
+            )
+        for post_id, tag_id in rows:
+            tag = tag_dict.get(tag_id)
+            if tag is not None:
+                res[post_id].append(tag)
         return res
 
-    @tags.setter
-    def tags(self, data: list[dict[str, Any]]) -> None:
-
+    def set_tags(self, data: Iterable[Mapping[str, Any]]) -> None:
+        """按标签名设置文章的标签, 不存在的标签会被创建."""
         with session:
             if self.id is None:
                 session.refresh(self)
-            new_tags = set()
-            old_tags = set()
+            new_tags: set[int] = set()
+            old_tags: set[int] = set()
             for item in data:
                 _tag = Tag.get_model_by_attr(name=item["name"])
                 if _tag is None:
@@ -100,15 +219,16 @@ class Post(BaseModel):
                 session.add(post_tag)
             for out_tag in out_tags:
                 session.execute(delete(PostTag).where(PostTag.post_id == self.id, PostTag.tag_id == out_tag))
+                _tag_changes(session)["incr"][out_tag] -= 1
             session.commit()
 
     @property
     def category(self) -> dict[str, Any]:
         cate = {"id": 0, "name": "默认分类"}
         if self.category_id > 0:
-            res = Category.get_model_by_id(self.category_id)
+            res = category_dict.get(self.category_id)
             if res:
-                cate = {"id": res.id, "name": res.name}
+                cate = {"id": res["id"], "name": res["name"]}
         return cate
 
     @property
@@ -133,8 +253,8 @@ class File(BaseModel):
     name: Mapped[str] = mapped_column(comment="名称")
     location: Mapped[int] = mapped_column(default=1, comment="文件保存位置: 1-本地, 2-云")
     type: Mapped[int] = mapped_column(default=0, comment="文件类型: 0-未知, 1-图片, 2-视频, 3-音频")  # noqa：A003
-    ext: Mapped[str] | None = mapped_column(default=None, comment="后缀")
+    ext: Mapped[str | None] = mapped_column(default=None, comment="后缀")
     create_time: Mapped[T_create_time] = mapped_column(default=None, comment="创建时间")
     update_time: Mapped[T_update_time] = mapped_column(default=None, comment="更新时间")
 
-    __tableargs__ = (Index("user_file", "user_id", "md5"),)
+    __table_args__ = (Index("user_file", "user_id", "md5"),)
@@ -124,7 +124,7 @@ class RolePermission(BaseModel):
     permission_id: Mapped[int] = mapped_column(BigInteger)
     create_time: Mapped[T_create_time] = mapped_column(default=None)
 
-    __tableargs__ = (Index("group_id_permission_id", "group_id", "permission_id", unique=True),)
+    __table_args__ = (Index("role_id_permission_id", "role_id", "permission_id", unique=True),)
 
 
 class Log(BaseModel):
@@ -96,3 +96,8 @@ class TagCreateSchema(BaseModel):
 class CommentUpdateSchema(BaseModel):
     type: int  # 1-置顶, 2-拉黑
     value: int  # 0-取消, 1-设置
+
+
+class NoticeBroadcastSchema(BaseModel):
+    content: str = Field(max_length=200)
+    mode: int = Field(1, ge=1, le=2, description="1-给每个用户写入一条消息, 2-只写入一条全员消息")
@@ -1,5 +1,11 @@
+from pydantic import BaseModel, Field
+
 from .common import PageSchema
 
 
 class NoticeSchema(PageSchema):
     type: int  # 0-查询未读消息, 1-查询所有消息
+
+
+class NoticeReadSchema(BaseModel):
+    ids: list[int] = Field(min_items=1, max_items=100)
@@ -0,0 +1,166 @@
+"""自动补全.
+
+每个进程持有一份只读快照, 查询时不访问数据库:
+
+- 前缀匹配: 按小写名称排序的数组, bisect 找到前缀的起始位置后顺序扫描。
+- 子串匹配: 前缀结果不足时, 取查询词的 n-gram(1 个字为 unigram, 否则为 bigram)对应 id 集合的交集再校验。
+- 排序: 前缀匹配在前, 同类结果按热度(score)从高到低。
+
+数据保存在 Redis 中, 所有 worker 共用, 写入时递增版本号, 其他 worker 查询时发现版本变化后重新加载:
+
+- `<key>:lex` sorted set, score 均为 0, member 为 `小写名称\\0id`, 通过 ZRANGEBYLEX 按字典序读取
+- `<key>:score` sorted set, member 为 id, score 为热度
+- `<key>:name` hash, id -> 原始名称
+- `<key>:version` 版本号, 不存在时通过 loader 从数据库重建
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Callable, Iterable
+from typing import Any
+
+from src.common.redis import redis
+
+# 前缀匹配最多扫描的数量, 避免单个字母扫描整个数组
+MAX_PREFIX_SCAN = 1000
+SEPARATOR = "\0"
+
+
+def ngrams(text: str) -> set[str]:
+    """所有 unigram 和 bigram."""
+    return set(text) | {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+class Snapshot:
+    def __init__(self, version: int, names: dict[int, str], scores: dict[int, float]) -> None:
+        self.version = version
+        self.names = names
+        self.scores = scores
+        self.keys = sorted((name.lower(), id) for id, name in names.items())
+        self.grams: dict[str, set[int]] = {}
+        for key, id in self.keys:
+            for gram in ngrams(key):
+                self.grams.setdefault(gram, set()).add(id)
+
+    def prefix(self, q: str) -> list[int]:
+        ids: list[int] = []
+        for key, id in self.keys[bisect_left(self.keys, (q,)) :]:
+            if not key.startswith(q) or len(ids) >= MAX_PREFIX_SCAN:
+                break
+            ids.append(id)
+        return ids
+
+    def substring(self, q: str) -> list[int]:
+        grams = {q} if len(q) == 1 else {q[i : i + 2] for i in range(len(q) - 1)}
+        candidates = set.intersection(*(self.grams.get(gram, set()) for gram in grams))
+        return [id for id in candidates if q in self.names[id].lower()]
+
+    def rank(self, ids: Iterable[int]) -> list[int]:
+        return sorted(ids, key=lambda id: (-self.scores.get(id, 0), self.names[id]))
+
+
+class Autocomplete:
+    def __init__(
+        self, key: str, loader: Callable[[], Iterable[tuple[int, str, float]]], check_interval: float = 1.0
+    ) -> None:
+        """loader 返回所有的 (id, 名称, 热度), 用于 Redis 中没有数据时重建."""
+        self.key = key
+        self.loader = loader
+        self.check_interval = check_interval
+        self._snapshot: Snapshot | None = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def complete(self, q: str, limit: int = 10) -> list[dict[str, Any]]:
+        q = q.strip().lower()
+        if not q:
+            return []
+        snapshot = self.snapshot()
+        ids = snapshot.rank(snapshot.prefix(q))[:limit]
+        if len(ids) < limit:
+            matched = set(ids)
+            ids += snapshot.rank(id for id in snapshot.substring(q) if id not in matched)[: limit - len(ids)]
+        return [{"id": id, "name": snapshot.names[id]} for id in ids]
+
+    def snapshot(self) -> Snapshot:
+        """当前快照, 每隔 check_interval 秒检查一次版本号."""
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._checked < self.check_interval:
+            return self._snapshot
+        with self._lock:
+            if self._snapshot is None or now - self._checked >= self.check_interval:
+                version = redis.get(f"{self.key}:version")
+                if version is None:
+                    self.rebuild()
+                    self._snapshot = self._load()
+                elif self._snapshot is None or self._snapshot.version != int(version):
+                    self._snapshot = self._load()
+                self._checked = now
+        return self._snapshot
+
+    def add(self, id: int, name: str) -> None:
+        """新增或重命名, 已有的热度保持不变."""
+        old = redis.hget(f"{self.key}:name", str(id))
+        pipe = redis.pipeline()
+        if old is not None:
+            pipe.zrem(f"{self.key}:lex", f"{old.lower()}{SEPARATOR}{id}")
+        pipe.zadd(f"{self.key}:lex", {f"{name.lower()}{SEPARATOR}{id}": 0})
+        pipe.zadd(f"{self.key}:score", {str(id): 0}, nx=True)
+        pipe.hset(f"{self.key}:name", str(id), name)
+        pipe.incr(f"{self.key}:version")
+        pipe.execute()
+        self._expire()
+
+    def remove(self, id: int) -> None:
+        name = redis.hget(f"{self.key}:name", str(id))
+        if name is None:
+            return
+        pipe = redis.pipeline()
+        pipe.zrem(f"{self.key}:lex", f"{name.lower()}{SEPARATOR}{id}")
+        pipe.zrem(f"{self.key}:score", str(id))
+        pipe.hdel(f"{self.key}:name", str(id))
+        pipe.incr(f"{self.key}:version")
+        pipe.execute()
+        self._expire()
+
+    def incr(self, scores: dict[int, float]) -> None:
+        """批量增减热度."""
+        pipe = redis.pipeline()
+        for id, amount in scores.items():
+            pipe.zincrby(f"{self.key}:score", amount, str(id))
+        pipe.incr(f"{self.key}:version")
+        pipe.execute()
+        self._expire()
+
+    def rebuild(self) -> None:
+        """从 loader 重建 Redis 中的数据."""
+        items = list(self.loader())
+        pipe = redis.pipeline()
+        pipe.delete(f"{self.key}:lex", f"{self.key}:score", f"{self.key}:name")
+        if items:
+            pipe.zadd(f"{self.key}:lex", {f"{name.lower()}{SEPARATOR}{id}": 0 for id, name, _ in items})
+            pipe.zadd(f"{self.key}:score", {str(id): score for id, _, score in items})
+            pipe.hset(f"{self.key}:name", mapping={str(id): name for id, name, _ in items})
+        pipe.incr(f"{self.key}:version")
+        pipe.execute()
+        self._expire()
+
+    def _load(self) -> Snapshot:
+        # MULTI 保证读到的是同一个版本的数据
+        pipe = redis.pipeline()
+        pipe.get(f"{self.key}:version")
+        pipe.zrangebylex(f"{self.key}:lex", "-", "+")
+        pipe.zrange(f"{self.key}:score", 0, -1, withscores=True)
+        pipe.hgetall(f"{self.key}:name")
+        version, members, scores, names = pipe.execute()
+        ids = {int(member.rpartition(SEPARATOR)[2]) for member in members}
+        return Snapshot(
+            int(version or 0),
+            {id: names[str(id)] for id in ids if str(id) in names},
+            {int(id): score for id, score in scores},
+        )
+
+    def _expire(self) -> None:
+        """本进程写入后下次查询立即检查版本号."""
+        self._checked = 0.0
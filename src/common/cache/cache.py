@@ -3,30 +3,39 @@ from typing import TypeVar
 
 from pydantic.main import BaseModel
 
-from .model import BaseNode
+from src.common.metrics import CACHE_REQUESTS
+
+from .model import GENERATION_PREFIX, BaseNode
 
 T = TypeVar("T", bound=BaseModel)
 
 
 def get(node: BaseNode) -> BaseNode | None:
-    data = node.Meta.storage.get(node._full_key())
+    # 命名空间版本号只读取一次, load 期间失效时结果写入旧版本, 不会被之后的读取命中
+    key = node._full_key()
+    data = node.Meta.storage.get(key)
     if data is not None:
+        CACHE_REQUESTS.labels(type(node).__name__, "hit").inc()
         data = node.Meta.serializer.loads(data)
         return node.parse_obj(data)
+    CACHE_REQUESTS.labels(type(node).__name__, "miss").inc()
     # 从源获取
     result = node.load()
     if result is not None:
         new_node = node.parse_obj(result)
-        set(new_node)
+        _set(new_node, key, node.Meta.ttl)
         return new_node
     # TODO: 没有查到数据 处理缓存穿透
     return None
 
 
 def set(node: BaseNode, ttl: timedelta | None = None) -> None:
-    delta = ttl if ttl is not None else node.Meta.ttl
+    _set(node, node._full_key(), ttl if ttl is not None else node.Meta.ttl)
+
+
+def _set(node: BaseNode, key: str, ttl: timedelta | None) -> None:
     data = node.Meta.serializer.dumps(node)
-    node.Meta.storage.set(node._full_key(), data, delta)
+    node.Meta.storage.set(key, data, ttl)
 
 
 def delete(node: BaseNode) -> None:
@@ -34,6 +43,15 @@ def delete(node: BaseNode) -> None:
     node.Meta.storage.delete(node._full_key())
 
 
+def expire(node: BaseNode) -> None:
+    """使 node 所属命名空间下的所有缓存失效."""
+    namespace = node.namespace()
+    if namespace is None:
+        delete(node)
+        return
+    node.Meta.storage.incr(GENERATION_PREFIX + namespace)
+
+
 def refresh(node: BaseNode) -> BaseModel | None:
     """刷新缓存."""
     delete(node)
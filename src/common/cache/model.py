@@ -27,17 +27,25 @@ class JSONSerializer:
         return res
 
 
-class BaseNode(BaseModel):
-    id: int
-    username: str | None = None
-    age: int | None = None
+GENERATION_PREFIX = "cache:generation:"
+
 
+class BaseNode(BaseModel):
     def _full_key(self) -> str:
-        return self.Meta.prefix + self.key()
+        namespace = self.namespace()
+        if namespace is None:
+            return self.Meta.prefix + self.key()
+        # 命名空间版本号变化后, 旧 key 不再被访问, 等待 ttl 过期
+        generation = self.Meta.storage.get(GENERATION_PREFIX + namespace) or 0
+        return f"{self.Meta.prefix}{namespace}:{int(generation)}:{self.key()}"
 
     def key(self) -> str:
         raise NotImplementedError()
 
+    def namespace(self) -> str | None:
+        """所属命名空间, 用于批量失效, 如某篇文章的所有评论分页."""
+        return None
+
     def load(self) -> Any:
         raise NotImplementedError()
 
@@ -30,17 +30,23 @@ class BaseStorage(ABC):
     def exists(self, key: str) -> bool:
         raise NotImplementedError()
 
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1) -> int:
+        raise NotImplementedError()
+
 
 class RedisStorage(BaseStorage):
     _redis: "Redis[bytes]"
 
-    def __init__(self, url: str, pool_size: int = 100) -> None:
+    def __init__(self, url: str, pool_size: int = 100, **options: Any) -> None:
+        """其它参数传给 Redis.from_url, 如 connection_class."""
         self.url = url
         self.pool_size = pool_size
+        self.options = options
         self.connect()
 
     def connect(self) -> None:
-        self._redis = Redis.from_url(self.url, max_connections=self.pool_size)
+        self._redis = Redis.from_url(self.url, max_connections=self.pool_size, **self.options)
 
     def close(self) -> None:
         self._redis.close()
@@ -56,3 +62,6 @@ class RedisStorage(BaseStorage):
 
     def exists(self, key: str) -> bool:
         return bool(self._redis.exists(key))
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        return self._redis.incrby(key, amount)
@@ -25,6 +25,9 @@ class Storage(Protocol):
     def exists(self, key: str) -> bool:
         ...
 
+    def incr(self, key: str, amount: int = 1) -> int:
+        ...
+
 
 class Serializer(Protocol):
     def dumps(self, obj: Any) -> bytes:
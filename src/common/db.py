@@ -1,4 +1,7 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
 from contextvars import ContextVar
+from pathlib import Path
 from typing import cast
 
 from flask import Flask
@@ -6,6 +9,9 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import Session, sessionmaker
 from werkzeug.local import LocalProxy
 
+from src.common.metrics import TimedQueuePool
+from src.common.slow_query import SlowQueryLog
+from src.common.timing import instrument_engine
 from src.config import config
 
 ctx_session: ContextVar["Session"] = ContextVar("session")
@@ -27,13 +33,24 @@ class DB:
         app.teardown_request(self.teardown_request)
 
         connect_args = {"check_same_thread": False} if "sqlite" in url else {}
+        # sqlite 使用默认连接池, 内存数据库只能有一个连接
+        poolclass = None if "sqlite" in url else TimedQueuePool
 
         self.engine = create_engine(
             url,
             connect_args=connect_args,
             pool_size=pool_size,
             pool_recycle=7200,
+            poolclass=poolclass,
         )
+        instrument_engine(self.engine)
+        if config.SLOW_QUERY_THRESHOLD > 0:
+            SlowQueryLog(
+                config.SLOW_QUERY_THRESHOLD,
+                config.SLOW_QUERY_INTERVAL,
+                config.SLOW_QUERY_EXPLAIN,
+                Path(config.BASE_DIR),
+            ).instrument(self.engine)
         self.Session = sessionmaker(self.engine)
         app.extensions["sqlalchemy"] = self
 
@@ -43,6 +60,16 @@ class DB:
         # session 可以看作是本地缓存
         return self.Session()
 
+    @contextmanager
+    def scope(self) -> Iterator["Session"]:
+        """在请求之外(如任务队列)使用 session."""
+        token = ctx_session.set(self.connect())
+        try:
+            yield ctx_session.get()
+        finally:
+            ctx_session.get().close()
+            ctx_session.reset(token)
+
     def teardown_request(self, exception: BaseException | None) -> None:
         try:
             session = ctx_session.get()
@@ -0,0 +1,131 @@
+"""进程内字典缓存.
+
+分类、标签这类很少变化、但每次序列化文章都要读取的数据, 每个进程只加载一次, 之后直接读内存。
+
+被 watch 的模型增删改并提交后会调用 bump(): 递增 Redis 中的版本号并发布到 `dict:changed` 频道,
+每个进程的监听线程收到消息后使本地数据过期, 下次读取时重新加载。监听断开期间的消息会丢失,
+所以(重新)订阅成功时所有字典都会过期, 并且每隔 check_interval 秒仍会比较一次版本号兜底。
+"""
+import os
+import threading
+import time
+from collections.abc import Callable, Iterable
+from typing import TYPE_CHECKING, Any, ClassVar
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from structlog import getLogger
+
+from src.common.redis import redis
+
+if TYPE_CHECKING:
+    from structlog.stdlib import BoundLogger
+
+logger: "BoundLogger" = getLogger("dictionary")
+
+CHANNEL = "dict:changed"
+VERSION_KEY = "dict:version:{}"
+CHANGES_INFO_KEY = "dictionary_changes"
+
+
+class Dictionary:
+    # 名称 -> 字典, 监听线程根据消息中的名称找到对应的字典
+    registry: ClassVar[dict[str, "Dictionary"]] = {}
+    _listener_pid: ClassVar[int | None] = None
+    _listener_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    def __init__(
+        self, name: str, loader: Callable[[], Iterable[dict[str, Any]]], check_interval: float = 30.0
+    ) -> None:
+        """loader 返回所有数据, 每条数据必须包含 id."""
+        self.name = name
+        self.loader = loader
+        self.check_interval = check_interval
+        self._items: dict[int, dict[str, Any]] | None = None
+        self._version = 0
+        self._stale = True
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.registry[name] = self
+
+    def get(self, id: int) -> dict[str, Any] | None:
+        return self.data().get(id)
+
+    def all(self) -> list[dict[str, Any]]:
+        return list(self.data().values())
+
+    def data(self) -> dict[int, dict[str, Any]]:
+        self._ensure_listening()
+        now = time.monotonic()
+        if self._items is not None and not self._stale and now - self._checked < self.check_interval:
+            return self._items
+        with self._lock:
+            if self._items is None or self._stale or now - self._checked >= self.check_interval:
+                # 先清除标记, 加载期间收到的变更会再次标记
+                stale, self._stale = self._stale, False
+                version = int(redis.get(VERSION_KEY.format(self.name)) or 0)
+                if self._items is None or stale or version != self._version:
+                    self._items = {item["id"]: item for item in self.loader()}
+                    self._version = version
+                self._checked = now
+        return self._items
+
+    def expire(self) -> None:
+        """使本地数据过期."""
+        self._stale = True
+
+    def bump(self) -> None:
+        """数据已修改, 通知所有进程重新加载."""
+        redis.incr(VERSION_KEY.format(self.name))
+        redis.publish(CHANNEL, self.name)
+        self.expire()
+
+    def watch(self, model: type[Any]) -> None:
+        """model 增删改并提交后自动 bump, 批量 UPDATE/DELETE 语句不会触发, 需要手动调用."""
+
+        def record(mapper: Any, connection: Any, target: Any) -> None:
+            db_session = object_session(target)
+            if db_session is not None:
+                db_session.info.setdefault(CHANGES_INFO_KEY, set()).add(self.name)
+
+        for identifier in ("after_insert", "after_update", "after_delete"):
+            event.listen(model, identifier, record)
+
+    @classmethod
+    def _ensure_listening(cls) -> None:
+        pid = os.getpid()
+        if cls._listener_pid == pid:
+            return
+        with cls._listener_lock:
+            if cls._listener_pid == pid:
+                return
+            threading.Thread(target=cls._listen, name="dictionary-listener", daemon=True).start()
+            cls._listener_pid = pid
+
+    @classmethod
+    def _listen(cls) -> None:
+        while True:
+            try:
+                pubsub = redis.pubsub()
+                pubsub.subscribe(CHANNEL)
+                for message in pubsub.listen():
+                    if message["type"] == "subscribe":
+                        # 断开期间可能错过了消息
+                        for dictionary in cls.registry.values():
+                            dictionary.expire()
+                    elif message["type"] == "message" and message["data"] in cls.registry:
+                        cls.registry[message["data"]].expire()
+            except Exception as e:
+                logger.exception(str(e))
+                time.sleep(1)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_changed(db_session: Session) -> None:
+    for name in db_session.info.pop(CHANGES_INFO_KEY, ()):
+        Dictionary.registry[name].bump()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed(db_session: Session) -> None:
+    db_session.info.pop(CHANGES_INFO_KEY, None)
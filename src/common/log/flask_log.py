@@ -4,13 +4,17 @@ import uuid
 import structlog
 from flask import Flask, Response, g, request
 
+from src.common import timing
+
 access_logger: structlog.stdlib.BoundLogger = structlog.get_logger("api.access")
 error_logger: structlog.stdlib.BoundLogger = structlog.get_logger("api.error")
 
 
 class FlaskLogger:
-    def __init__(self, app: Flask) -> None:
+    def __init__(self, app: Flask, server_timing: bool = True) -> None:
+        """server_timing: 是否在响应头 Server-Timing 中返回耗时分解."""
         self.app = app
+        self.server_timing = server_timing
 
         self.registe_log()
 
@@ -23,6 +27,7 @@ class FlaskLogger:
                 request_id=request_id,
             )
             g.start_time = time.perf_counter_ns()
+            g.timing_token = timing.start()
 
         @self.app.after_request
         def log_request_after(response: Response) -> Response:
@@ -33,6 +38,10 @@ class FlaskLogger:
             status_code = response.status_code
             remote_addr = request.remote_addr
             message = f'{remote_addr} - "{http_method} {url} HTTP/{http_version}" {status_code}'
+            # 数据库、Redis、Elasticsearch 的调用次数和耗时
+            request_timing = timing.current()
+            if request_timing is not None and self.server_timing:
+                response.headers["Server-Timing"] = request_timing.server_timing(process_time)
             access_logger.info(
                 message,
                 http={
@@ -40,10 +49,17 @@ class FlaskLogger:
                     "status_code": status_code,
                     "method": http_method,
                     "version": http_version,
+                    "route": request.url_rule.rule if request.url_rule else None,
                 },
                 network={"client": remote_addr},
                 duration=process_time,
+                timing=request_timing.as_dict() if request_timing is not None else None,
             )
             return response
 
+        @self.app.teardown_request
+        def log_request_teardown(exception: BaseException | None) -> None:
+            if hasattr(g, "timing_token"):
+                timing.stop(g.timing_token)
+
         self.app.logger = error_logger
@@ -1,7 +1,29 @@
+import atexit
+import copy
 import datetime
+import fcntl
+import gzip
 import logging
-from logging.handlers import BaseRotatingHandler
+import os
+import queue
+import shutil
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from logging.handlers import BaseRotatingHandler, QueueHandler, RotatingFileHandler, TimedRotatingFileHandler
 from pathlib import Path
+from typing import Any
+
+import structlog
+
+# policies of LinQueueHandler when the queue is full
+POLICY_DROP = "drop"
+POLICY_BLOCK = "block"
+# seconds between two checks of the log file shared with other processes
+CHECK_INTERVAL = 1.0
+# rotated files are compressed once they have not been written for this many seconds
+COMPRESS_DELAY = 60.0
 
 
 class LinRotatingFileHandler(BaseRotatingHandler):
@@ -11,6 +33,16 @@ class LinRotatingFileHandler(BaseRotatingHandler):
     the year, month, and day. Logs are rotated daily or when they exceed a specified maximum size, and are renamed to
     include the current time in case the filename already exists.
 
+    The timestamp of the next daily rollover and the size of the current file are kept in memory, so checking for a
+    rollover only compares numbers. Several processes (e.g. gunicorn workers) may write the same file: at most once
+    per ``CHECK_INTERVAL`` the size is read back from the file, and the file is reopened if another process has
+    rotated it. A size rollover is done under an exclusive lock on ``<log_dir>/.rotate.lock``, so only the first
+    process renames the file and the others just reopen it.
+
+    Rotated files can be gzipped in a background thread. Other processes may still write to a rotated file until
+    they notice the rollover, so only files that have not been modified for ``COMPRESS_DELAY`` seconds are
+    compressed, on a later rollover.
+
     Args:
         log_dir (Union[str, Path]): The path to the logs directory.
         mode (str): The default file mode for opening the log file.
@@ -18,11 +50,15 @@ class LinRotatingFileHandler(BaseRotatingHandler):
         encoding (Optional[str]): The encoding used when writing to the log file.
         delay (bool): If True, the file is opened in 'delayed' mode, which defers creation until the first message is
             written.
+        compress (bool): If True, files closed by a size rollover are compressed to ``.gz`` in a background thread.
 
     Attributes:
         _log_dir (Path): The resolved path to the logs directory.
         _suffix (str): File extension for the log files.
         _year_month (str): Current year and month, used in creating new log directories.
+        _rollover_at (int): Timestamp of the next daily rollover.
+        _bytes (int): Size of the current log file.
+        _checked_at (float): Timestamp of the last check of the file on disk.
         store_dir (Path): Path to the currently active log directory.
         filename (str): Current year, month, and day, used in naming log files.
         max_bytes (int): Maximum size of the rotated log files.
@@ -35,59 +71,349 @@ class LinRotatingFileHandler(BaseRotatingHandler):
         max_bytes: int = 0,
         encoding: str | None = None,
         delay: bool = False,
+        compress: bool = False,
     ) -> None:
         if max_bytes > 0:
             mode = "a"
         self._log_dir = Path(log_dir).resolve()
         self._suffix = ".log"
-        now = datetime.datetime.now(datetime.UTC)
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self._open_day(datetime.datetime.now(datetime.UTC))
+        super().__init__(self.store_dir / f"{self.filename}{self._suffix}", mode, encoding, delay)
+        self._encoding = encoding or "utf-8"
+
+    def _open_day(self, now: datetime.datetime) -> None:
+        """Switch to the log file of the day of ``now``."""
         self._year_month = now.strftime("%Y-%m")
         self.store_dir = self._log_dir / self._year_month
         self.store_dir.mkdir(parents=True, exist_ok=True)
         self.filename = now.strftime("%Y-%m-%d")
-        filename = self.store_dir / f"{self.filename}{self._suffix}"
-        super().__init__(filename, mode, encoding, delay)
-        self.max_bytes = max_bytes
+        tomorrow = now.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+        self._rollover_at = int(tomorrow.timestamp())
+        path = self.store_dir / f"{self.filename}{self._suffix}"
+        self._bytes = path.stat().st_size if path.exists() else 0
+        self._checked_at = now.timestamp()
 
     def doRollover(self) -> None:  # noqa
         now = datetime.datetime.now(datetime.UTC)
-        year_month = now.strftime("%Y-%m")
-        filename = now.strftime("%Y-%m-%d")
 
+        opened = None
         if self.stream:
+            opened = os.fstat(self.stream.fileno()).st_ino
             self.stream.close()
             del self.stream
 
-        if self.filename != filename or self._year_month != year_month:
-            self.baseFilename = str(self._log_dir / year_month / filename / self._suffix)
-            self._year_month = year_month
-            self.filename = filename
+        if now.timestamp() >= self._rollover_at:
+            self._open_day(now)
+            self.baseFilename = str(self.store_dir / f"{self.filename}{self._suffix}")
         else:
-            dfn = self.rotation_filename(
-                self.baseFilename.replace(
-                    self._suffix,
-                    "-" + now.strftime("%H-%M-%S") + self._suffix,
-                )
-            )
-            Path(dfn).unlink(missing_ok=True)
-            self.rotate(self.baseFilename, dfn)
+            with _locked(self._log_dir / ".rotate.lock"):
+                self._rotate(now, opened)
         if not self.delay:
             self.stream = self._open()
 
+    def _rotate(self, now: datetime.datetime, opened: int | None) -> None:
+        """Rename the current file unless another process has already rotated it.
+
+        Args:
+            now (datetime.datetime): Time of the rollover.
+            opened (Optional[int]): Inode of the file this handler had open.
+        """
+        base = Path(self.baseFilename)
+        self._checked_at = now.timestamp()
+        try:
+            current = base.stat()
+        except FileNotFoundError:
+            self._bytes = 0
+            return
+        if opened is not None and current.st_ino != opened:
+            self._bytes = current.st_size
+            return
+        name = f"{base.stem}-{now:%H-%M-%S}"
+        dfn = self.rotation_filename(str(base.with_name(f"{name}{self._suffix}")))
+        # add an index when rolling over more than once in the same second
+        index = 0
+        while Path(dfn).exists() or Path(f"{dfn}.gz").exists():
+            index += 1
+            dfn = self.rotation_filename(str(base.with_name(f"{name}-{index}{self._suffix}")))
+        self.rotate(self.baseFilename, dfn)
+        self._bytes = 0
+        if self.compress:
+            # the file just rotated is left for a later rollover
+            rotated = list(self.store_dir.glob(f"????-??-??-??-??-??*{self._suffix}"))
+            threading.Thread(target=compress_idle_files, args=(rotated,), name="log-compress", daemon=True).start()
+
+    def _check_file(self, now: float) -> None:
+        """Read the size back from the file, reopening it if another process has rotated it."""
+        self._checked_at = now
+        if self.stream is None:
+            return
+        self.stream.flush()
+        try:
+            current = Path(self.baseFilename).stat()
+        except FileNotFoundError:
+            current = None
+        if current is None or current.st_ino != os.fstat(self.stream.fileno()).st_ino:
+            self.stream.close()
+            self.stream = self._open()
+            current = os.fstat(self.stream.fileno())
+        self._bytes = current.st_size
+
     def shouldRollover(self, record: logging.LogRecord) -> bool:  # noqa
-        """Determine if a rollover should occur."""
-        now = datetime.datetime.now(datetime.UTC)
-        year_month = now.strftime("%Y-%m")
-        filename = now.strftime("%Y-%m-%d")
+        """Determine if a rollover should occur, without the size of ``record`` itself."""
+        return record.created >= self._rollover_at or 0 < self.max_bytes <= self._bytes
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.write(self.format(record) + self.terminator, record.created)
+            self.flush()
+        except Exception:  # noqa: BLE001
+            self.handleError(record)
 
+    def write(self, msg: str, created: float) -> None:
+        """Write a formatted message without flushing, rolling over first if needed."""
+        size = len(msg) if msg.isascii() else len(msg.encode(self._encoding))
+        if created >= self._checked_at + CHECK_INTERVAL:
+            self._check_file(created)
+        if created >= self._rollover_at or (
+            self.max_bytes > 0 and self._bytes > 0 and self._bytes + size > self.max_bytes
+        ):
+            self.doRollover()
         if self.stream is None:
             self.stream = self._open()
+        self.stream.write(msg)
+        self._bytes += size
+
+
+@contextmanager
+def _locked(path: Path) -> Iterator[None]:
+    """Hold an exclusive ``fcntl`` lock on ``path``, shared by all processes."""
+    with path.open("a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def compress_idle_files(paths: list[Path]) -> None:
+    """Compress the files that have not been modified for ``COMPRESS_DELAY`` seconds."""
+    deadline = time.time() - COMPRESS_DELAY
+    for path in paths:
+        try:
+            idle = path.stat().st_mtime < deadline
+        except FileNotFoundError:
+            continue
+        if idle:
+            compress_file(path)
+
+
+def compress_file(path: Path) -> None:
+    """Gzip ``path`` to ``path.gz`` and remove it, the original is kept if compression fails.
+
+    The temporary file is created exclusively, so a file is compressed by one process only.
+    """
+    target = path.with_name(f"{path.name}.gz")
+    tmp = path.with_name(f"{path.name}.gz.tmp")
+    try:
+        raw = tmp.open("xb")
+    except FileExistsError:
+        return
+    try:
+        with raw, path.open("rb") as src, gzip.open(raw, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        tmp.replace(target)
+        path.unlink()
+    except FileNotFoundError:
+        # compressed by another process in the meantime
+        tmp.unlink(missing_ok=True)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+        logging.getLogger("log").exception("compress log file failed: %s", path)
+
+
+class LinQueueHandler(QueueHandler):
+    """QueueHandler with a bounded queue and a background writer thread.
+
+    Records are put into the queue on the calling thread and written to the target handlers by a
+    ``BatchQueueListener``, so request threads never wait on file I/O. When the queue is full, the record is either
+    dropped (and counted) or the caller blocks until there is room, depending on ``policy``.
+
+    The listener thread does not survive ``fork``, so the queue and the listener are recreated lazily in each process.
 
-        if self._year_month != year_month or self.filename != filename:
-            return True
-        if self.max_bytes > 0:
-            msg = "%s\n" % self.format(record)
-            self.stream.seek(0, 2)
-            if self.stream.tell() + len(msg) > self.max_bytes:
-                return True
-        return False
+    Args:
+        handlers (logging.Handler): The handlers that actually write the records.
+        queue_size (int): Maximum number of records waiting to be written.
+        policy (str): What to do when the queue is full, ``"drop"`` or ``"block"``.
+        flush_interval (float): Seconds between flushes of the target handlers.
+        batch_size (int): Maximum number of records written between two checks of the flush interval.
+
+    Attributes:
+        dropped (int): Number of records dropped since the last report.
+    """
+
+    def __init__(
+        self,
+        *handlers: logging.Handler,
+        queue_size: int = 10000,
+        policy: str = "drop",
+        flush_interval: float = 1.0,
+        batch_size: int = 500,
+    ) -> None:
+        if policy not in (POLICY_DROP, POLICY_BLOCK):
+            raise ValueError(f"unknown queue policy: {policy}")
+        self.records: queue.Queue[logging.LogRecord | None] = queue.Queue(queue_size)
+        super().__init__(self.records)
+        self.handlers = handlers
+        self.queue_size = queue_size
+        self.policy = policy
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.listener: BatchQueueListener | None = None
+        self._pid: int | None = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self._ensure_listening()
+        super().emit(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.policy == POLICY_BLOCK:
+            self.records.put(record)
+            return
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Keep the record unformatted, formatting is done on the listener thread.
+
+        structlog records already carry the merged context in ``record.msg``. For stdlib records, the context
+        variables of the calling thread are copied onto the record so that ``ExtraAdder`` picks them up later.
+        """
+        record = copy.copy(record)
+        if not isinstance(record.msg, dict):
+            for key, value in structlog.contextvars.get_contextvars().items():
+                record.__dict__.setdefault(key, value)
+        return record
+
+    def stop(self) -> None:
+        """Write all queued records and stop the listener."""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+            self._pid = None
+
+    def _ensure_listening(self) -> None:
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                # Forked: the queue may hold records of the parent and its lock may be in any state
+                self.queue = self.records = queue.Queue(self.queue_size)
+            self.listener = BatchQueueListener(self, *self.handlers)
+            self.listener.start()
+            self._pid = pid
+
+
+class BatchQueueListener:
+    """Background thread that writes the records of a ``LinQueueHandler`` in batches.
+
+    Stream handlers are written directly and flushed at most once per ``flush_interval``, instead of once per record,
+    other handlers are called through ``handle``.
+    """
+
+    _sentinel = None
+
+    def __init__(self, handler: LinQueueHandler, *handlers: logging.Handler) -> None:
+        self.handler = handler
+        self.queue = handler.records
+        self.handlers = handlers
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._monitor, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self.queue.put(self._sentinel)
+            self._thread.join()
+            self._thread = None
+
+    def _monitor(self) -> None:
+        last_flush = time.monotonic()
+        pending = False
+        while True:
+            try:
+                records: list[logging.LogRecord | None] = [self.queue.get(timeout=self.handler.flush_interval)]
+            except queue.Empty:
+                records = []
+            while records and len(records) < self.handler.batch_size:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = self._sentinel in records
+            if stopping:
+                records = records[: records.index(self._sentinel)]
+            if records:
+                self._write([record for record in records if record is not None])
+                pending = True
+            now = time.monotonic()
+            if pending and (stopping or not records or now - last_flush >= self.handler.flush_interval):
+                self._report_dropped()
+                self._flush()
+                last_flush = now
+                pending = False
+            if stopping:
+                return
+
+    def _write(self, records: list[logging.LogRecord]) -> None:
+        for handler in self.handlers:
+            if isinstance(handler, logging.StreamHandler):
+                self._write_stream(handler, records)
+                continue
+            for record in records:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def _write_stream(self, handler: "logging.StreamHandler[Any]", records: list[logging.LogRecord]) -> None:
+        """Write without flushing, ``_flush`` is called once per flush interval."""
+        with handler.lock:  # type: ignore[union-attr]
+            for record in records:
+                if record.levelno < handler.level or not handler.filter(record):
+                    continue
+                try:
+                    if isinstance(handler, LinRotatingFileHandler):
+                        handler.write(handler.format(record) + handler.terminator, record.created)
+                        continue
+                    if isinstance(handler, RotatingFileHandler | TimedRotatingFileHandler) and handler.shouldRollover(
+                        record
+                    ):
+                        handler.doRollover()
+                    if isinstance(handler, logging.FileHandler) and handler.stream is None:
+                        handler.stream = handler._open()
+                    if handler.stream is not None:
+                        handler.stream.write(handler.format(record) + handler.terminator)
+                except Exception:  # noqa: BLE001
+                    handler.handleError(record)
+
+    def _flush(self) -> None:
+        for handler in self.handlers:
+            handler.flush()
+
+    def _report_dropped(self) -> None:
+        dropped, self.handler.dropped = self.handler.dropped, 0
+        if dropped:
+            record = logging.LogRecord(
+                "log", logging.WARNING, __file__, 0, "log queue full, %d records dropped", (dropped,), None
+            )
+            self._write([record])
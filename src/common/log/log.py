@@ -5,12 +5,17 @@
 模块中的 Logger 类具有两种模式:
 - 开发模式: Log 输出到 stdout。
 - 生产模式: Log 输出到 文件(可以 JSON格式), 在生成环境中使用。
+
+access 日志量大时可以通过 sample_rate 只保留部分 2xx 的记录, 错误和非 2xx 的记录始终保留。
 """
 import logging
+from typing import Any
 
+import orjson
 import structlog
 
-from .handler import LinRotatingFileHandler
+from .handler import LinQueueHandler, LinRotatingFileHandler
+from .processor import AccessSampler
 
 # 无论开发还是生产, 标准 logging 还是 structlog 都需要的 Processors
 stdlib_and_struct_processors: list[structlog.typing.Processor] = [
@@ -28,6 +33,14 @@ stdlib_and_struct_processors: list[structlog.typing.Processor] = [
 ]
 
 
+def orjson_dumps(event_dict: structlog.typing.EventDict, **kwargs: Any) -> str:
+    """使用 orjson 序列化.
+
+    orjson 输出 bytes, 但 logging.Formatter 必须返回 str, 所以这里解码一次(日志基本是 ASCII, 开销很小)。
+    """
+    return orjson.dumps(event_dict, option=orjson.OPT_NON_STR_KEYS, **kwargs).decode()
+
+
 class Logger:
     """该类是一个基于 Structlog 日志全局初始化封装, 用于将全局信息集中到单个日志中.
 
@@ -36,6 +49,14 @@ class Logger:
     Attributes:
         log_level (str): 日志级别。默认值: "INFO"
         is_production (bool): 是否为生产环境。默认值: False。
+        queue_size (int): 大于 0 时启用队列模式, 日志先放入该长度的队列, 由后台线程批量写入。默认值: 0。
+        queue_policy (str): 队列满时的策略, drop-丢弃并计数, block-阻塞等待。默认值: "drop"。
+        flush_interval (float): 队列模式下刷新到文件的间隔(秒)。默认值: 1.0。
+        max_bytes (int): 生产模式下单个日志文件的大小上限, 超过后切分, 0 表示只按天切分。默认值: 0。
+        compress (bool): 按大小切分出的文件是否在后台线程中 gzip 压缩。默认值: False。
+        log_format (str): 日志格式, console-控制台格式, json-每行一个 JSON。默认值: "console"。
+        sample_rate (float): 2xx access 日志的保留比例。默认值: 1.0。
+        sample_routes (dict[str, float] | None): 按路由规则覆盖 sample_rate。默认值: None。
         processors (list[structlog.typing.Processor]): 无论是开发还是生产环境,
             标准 logging 还是 structlog 都需要的 Processors。
         renderer (structlog.typing.Processor): event_dict to str|bytes|tuple 的处理器(processors链上暂居最后位置)。
@@ -53,23 +74,49 @@ class Logger:
 
     log_level = "INFO"
     is_production = False
+    queue_size = 0
+    queue_policy = "drop"
+    flush_interval = 1.0
+    max_bytes = 0
+    compress = False
+    log_format = "console"
     # event_dict -> event_dict
     processors: list[structlog.typing.Processor]
     # event_dict -> str | bytes | tuple
     # Processors 链最后一个
     renderer: structlog.typing.Processor
 
-    def __init__(self, log_level: str = "INFO", is_production: bool = True) -> None:
+    def __init__(
+        self,
+        log_level: str = "INFO",
+        is_production: bool = True,
+        queue_size: int = 0,
+        queue_policy: str = "drop",
+        flush_interval: float = 1.0,
+        max_bytes: int = 0,
+        compress: bool = False,
+        log_format: str = "console",
+        sample_rate: float = 1.0,
+        sample_routes: dict[str, float] | None = None,
+    ) -> None:
         self.log_level = log_level
         self.is_production = is_production
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.log_format = log_format
+        self.sampler = AccessSampler(sample_rate, sample_routes) if sample_rate < 1 or sample_routes else None
         self.processors = stdlib_and_struct_processors
-        if is_production:
+        if is_production or log_format == "json":
             # 将 异常堆栈 格式化
             self.processors.append(structlog.processors.format_exc_info)
 
+        if log_format == "json":
+            self.renderer = structlog.processors.JSONRenderer(serializer=orjson_dumps)
+        elif is_production:
             self.renderer = structlog.dev.ConsoleRenderer(colors=False)
-            # 还可以使用 json
-            # >>> self.renderer = structlog.processors.JSONRenderer(serializer=json.dumps)
         else:
             self.renderer = structlog.dev.ConsoleRenderer(colors=True)
 
@@ -80,6 +127,8 @@ class Logger:
         """设置全局 structlog 配置."""
         structlog.configure(
             processors=[
+                # 采样放在最前面, 被丢弃的日志不再执行后续的 processor
+                *([self.sampler] if self.sampler else []),
                 *self.processors,
                 # 因为需要使用 ProcessorFormatter, 所以最后一个必须是这个
                 # ProcessorFormatter 内部的 chain 最后一个必须是 renderer
@@ -101,14 +150,21 @@ class Logger:
             ],
         )
         root = logging.getLogger()
+        handler: logging.Handler
         if self.is_production:
-            file_handler = LinRotatingFileHandler()
-            file_handler.setFormatter(formatter)
-            root.addHandler(file_handler)
+            handler = LinRotatingFileHandler(max_bytes=self.max_bytes, compress=self.compress)
         else:
             handler = logging.StreamHandler()
-            handler.setFormatter(formatter)
-            root.addHandler(handler)
+        handler.setFormatter(formatter)
+        if self.queue_size > 0:
+            # 请求线程只负责入队, 格式化和写文件都在后台线程中完成
+            handler = LinQueueHandler(
+                handler,
+                queue_size=self.queue_size,
+                policy=self.queue_policy,
+                flush_interval=self.flush_interval,
+            )
+        root.addHandler(handler)
 
         root.setLevel(self.log_level)
 
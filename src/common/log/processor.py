@@ -1,20 +1,14 @@
 import logging
+import random
 import re
+from typing import Any
 
 import structlog
 
-
-def combined_logformat(
-    _: logging.Logger, __: str, event_dict: structlog.typing.EventDict
-) -> structlog.typing.EventDict:
-    """Custom processor for Gunicorn access events.
-
-    应用在 struclog 的 processor 中, 后期会使用自定义 access
-    """
-    if event_dict.get("logger") == "gunicorn.access":
-        message = event_dict["event"]
-
-        parts = [
+# gunicorn 默认的 access_log_format: %(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"
+COMBINED_PATTERN = re.compile(
+    r"\s+".join(
+        [
             r"(?P<host>\S+)",  # host %h
             r"\S+",  # indent %l (unused)
             r"(?P<user>\S+)",  # user %u
@@ -25,30 +19,113 @@ def combined_logformat(
             r'"(?P<referer>.*)"',  # referer "%{Referer}i"
             r'"(?P<agent>.*)"',  # user agent "%{User-agent}i"
         ]
-        pattern = re.compile(r"\s+".join(parts) + r"\s*\Z")
-        m = pattern.match(message)
-        res = m.groupdict()  # type: ignore[union-attr]
+    )
+    + r"\s*\Z"
+)
+
+
+def _split_access_line(message: str) -> dict[str, str] | None:
+    """按空格和引号切分, 只处理字段之间是单个空格的常见格式, 不符合时返回 None."""
+    try:
+        host, _, user, rest = message.split(" ", 3)
+        if rest[0] != "[":
+            return None
+        end = rest.index("] ")
+        time, rest = rest[1:end], rest[end + 2 :]
+        if rest[0] != '"':
+            return None
+        end = rest.index('" ', 1)
+        request, rest = rest[1:end], rest[end + 2 :]
+        status, size, rest = rest.rstrip().split(" ", 2)
+        if not status.isdigit() or len(rest) < 5 or rest[0] != '"' or rest[-1] != '"':
+            return None
+        referer, agent = rest[1:-1].split('" "', 1)
+    except (ValueError, IndexError):
+        return None
+    return {
+        "host": host,
+        "user": user,
+        "time": time,
+        "request": request,
+        "status": status,
+        "size": size,
+        "referer": referer,
+        "agent": agent,
+    }
 
-        if res["user"] == "-":
-            res["user"] = None
 
-        res["status"] = int(res["status"])
+def parse_access_line(message: str) -> dict[str, Any] | None:
+    """解析 gunicorn access 日志, 无法解析时返回 None.
+
+    status、size 转换为 int, user、referer 为 "-" 时为 None, size 为 "-" 时为 0。
+    """
+    res: dict[str, Any] | None = _split_access_line(message)
+    if res is None:
+        m = COMBINED_PATTERN.match(message)
+        if m is None:
+            return None
+        res = m.groupdict()
+    if res["user"] == "-":
+        res["user"] = None
+    res["status"] = int(res["status"])
+    res["size"] = 0 if res["size"] == "-" else int(res["size"])
+    if res["referer"] == "-":
+        res["referer"] = None
+    return res
+
 
-        if res["size"] == "-":
-            res["size"] = 0
-        else:
-            res["size"] = int(res["size"])
+def combined_logformat(
+    _: logging.Logger, __: str, event_dict: structlog.typing.EventDict
+) -> structlog.typing.EventDict:
+    """Custom processor for Gunicorn access events.
 
-        if res["referer"] == "-":
-            res["referer"] = None
+    应用在 struclog 的 processor 中, 后期会使用自定义 access
+    """
+    if event_dict.get("logger") == "gunicorn.access":
+        res = parse_access_line(event_dict["event"])
+        if res is None:
+            return event_dict
 
         event_dict.update(res)
 
-        del event_dict["event"]
-        # del event_dict["host"]  # noqa
-        del event_dict["user"]
-        del event_dict["time"]
-        del event_dict["size"]
-        del event_dict["agent"]
-        del event_dict["thread"]
+        for key in ("event", "user", "time", "size", "agent", "thread"):
+            event_dict.pop(key, None)
     return event_dict
+
+
+class AccessSampler:
+    """只保留部分 2xx 的 access 日志, 其它状态码和其它 logger 的日志全部保留.
+
+    应放在 structlog processors 的第一位, 被丢弃的日志不再执行后续的 processor。
+    保留的日志会带上 sample_rate, 方便统计时还原总量。
+
+    Args:
+        rate: 2xx access 日志的保留比例, 0~1。
+        routes: 按路由规则(如 "/post/<int:id>")覆盖保留比例。
+        logger_names: access 日志的 logger 名称。
+    """
+
+    def __init__(
+        self, rate: float = 1.0, routes: dict[str, float] | None = None, logger_names: tuple[str, ...] = ("api.access",)
+    ) -> None:
+        self.rate = rate
+        self.routes = routes or {}
+        self.logger_names = logger_names
+
+    def __call__(
+        self, logger: logging.Logger, _: str, event_dict: structlog.typing.EventDict
+    ) -> structlog.typing.EventDict:
+        if getattr(logger, "name", None) not in self.logger_names:
+            return event_dict
+        http = event_dict.get("http") or {}
+        if not 200 <= http.get("status_code", 0) < 300:
+            return event_dict
+        route = http.get("route")
+        rate = self.routes.get(route, self.rate) if route is not None else self.rate
+        if rate >= 1:
+            return event_dict
+        if random.random() >= rate:  # noqa: S311
+            raise structlog.DropEvent
+        event_dict["sample_rate"] = rate
+        return event_dict
+
@@ -0,0 +1,141 @@
+"""Prometheus 指标.
+
+- http_request_duration_seconds: 请求耗时, 按 endpoint(蓝图.视图函数) 和状态码区分
+- db_pool_checkout_seconds: 从连接池获取数据库连接的等待时间
+- cache_requests_total: 缓存节点读取次数, 按节点类型和 hit/miss 区分, 用于计算命中率
+- websocket_connections: websocket 连接数
+- wakaq_queue_depth: 任务队列长度, 抓取时从 Redis 读取
+
+gunicorn 多 worker 部署时, 每个 worker 的指标写入 PROMETHEUS_MULTIPROC_DIR 目录下的 mmap 文件,
+/metrics 读取该目录下所有文件汇总。该环境变量必须在导入 prometheus_client 之前设置, 见 src/config/gunicorn.py。
+"""
+import os
+import time
+from collections.abc import Iterator
+from typing import TYPE_CHECKING, Any
+
+from flask import Flask, Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+from prometheus_client.registry import Collector
+from redis.exceptions import RedisError
+from sqlalchemy.pool import QueuePool
+from structlog import getLogger
+
+if TYPE_CHECKING:
+    from structlog.stdlib import BoundLogger
+
+logger: "BoundLogger" = getLogger("metrics")
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency.",
+    ["endpoint", "status"],
+)
+DB_POOL_CHECKOUT = Histogram(
+    "db_pool_checkout_seconds",
+    "Time spent waiting for a database connection from the pool.",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Cache node reads.",
+    ["node", "result"],
+)
+WS_CONNECTIONS = Gauge(
+    "websocket_connections",
+    "Open websocket connections.",
+    multiprocess_mode="livesum",
+)
+
+
+class TimedQueuePool(QueuePool):
+    """记录获取连接等待时间的连接池, 包括新建连接的时间."""
+
+    def _do_get(self) -> Any:
+        begin = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT.observe(time.perf_counter() - begin)
+
+
+class QueueDepthCollector(Collector):
+    """抓取时读取 wakaq 队列长度, 包括延迟执行(eta)的任务."""
+
+    @staticmethod
+    def _family() -> GaugeMetricFamily:
+        return GaugeMetricFamily("wakaq_queue_depth", "Tasks waiting in wakaq queues.", labels=["queue", "type"])
+
+    def describe(self) -> Iterator[GaugeMetricFamily]:
+        # 注册时只需要指标名, 否则 register() 会调用 collect() 导入任务模块并读取 Redis
+        yield self._family()
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        # 任务模块依赖 create_app, 在这里导入避免循环引用
+        from src.common.task import app as task_app  # noqa: PLC0415
+
+        depth = self._family()
+        pipe = task_app.broker.pipeline(transaction=False)
+        for queue in task_app.queues:
+            pipe.llen(queue.broker_key)
+            pipe.zcard(queue.broker_eta_key)
+        try:
+            counts = pipe.execute()
+        except RedisError as e:
+            # 不影响其它指标
+            logger.warning("collect queue depth failed", error=str(e))
+            return
+        for i, queue in enumerate(task_app.queues):
+            depth.add_metric([queue.name, "ready"], counts[2 * i])
+            depth.add_metric([queue.name, "eta"], counts[2 * i + 1])
+        yield depth
+
+
+class Metrics:
+    def __init__(self, app: Flask | None = None) -> None:
+        self.queue_collector = QueueDepthCollector()
+        self._registered = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.add_url_rule("/metrics", "metrics", self.view)
+        if not self._registered:
+            REGISTRY.register(self.queue_collector)
+            self._registered = True
+        app.extensions["metrics"] = self
+
+    def before_request(self) -> None:
+        g.metrics_start = time.perf_counter()
+
+    def after_request(self, response: Response) -> Response:
+        if hasattr(g, "metrics_start") and request.endpoint != "metrics":
+            REQUEST_DURATION.labels(request.endpoint or "none", response.status_code).observe(
+                time.perf_counter() - g.metrics_start
+            )
+        return response
+
+    def view(self) -> Response:
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+            # 每次抓取都汇总所有 worker 的 mmap 文件
+            registry = CollectorRegistry()
+            MultiProcessCollector(registry)
+            registry.register(self.queue_collector)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+metrics = Metrics()
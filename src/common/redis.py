@@ -1,8 +1,18 @@
-from redis import Redis
+from redis import ConnectionPool, Redis
 
+from src.common.cache import RedisStorage
+from src.common.timing import TimedConnection
 from src.config import config
 
-redis = Redis.from_url(
-    config.REDIS_URL,
+# from_url 的类型声明不接受 connection_class, 先单独创建连接池
+redis = Redis(
+    connection_pool=ConnectionPool.from_url(
+        config.REDIS_URL,
+        decode_responses=True,
+        connection_class=TimedConnection,
+    ),
     decode_responses=True,
 )
+
+# 缓存节点默认使用的存储
+storage = RedisStorage(url=config.REDIS_URL, connection_class=TimedConnection)
@@ -0,0 +1,15 @@
+from .backend import BaseBackend, ESBackend
+from .inverted import InvertedIndex, InvertedIndexBackend
+from .searchable import ES, SYNC_SCHEDULED_KEY, Searchable, SearchPage, es
+
+__all__ = (
+    "es",
+    "ES",
+    "Searchable",
+    "SearchPage",
+    "SYNC_SCHEDULED_KEY",
+    "BaseBackend",
+    "ESBackend",
+    "InvertedIndex",
+    "InvertedIndexBackend",
+)
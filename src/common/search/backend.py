@@ -0,0 +1,178 @@
+"""搜索后端.
+
+Searchable 只负责模型与文档之间的转换, 索引的创建、写入和查询都交给后端完成:
+
+- ESBackend: Elasticsearch, 生产环境使用。
+- InvertedIndexBackend: 进程内倒排索引, 用于无法运行 Elasticsearch 的小型部署和测试。
+
+bulk 的操作与 Elasticsearch bulk API 的格式相同: {"_op_type": "index" | "delete", "_id": id, "_source": {...}}。
+highlight 参数与 Elasticsearch search API 的 highlight 相同, 只使用 pre_tags、post_tags、
+fragment_size、number_of_fragments 和 fields。
+"""
+from abc import ABC, abstractmethod
+from collections.abc import Iterable
+from typing import TYPE_CHECKING, Any
+
+from elasticsearch import Elasticsearch, NotFoundError, helpers
+from structlog import getLogger
+
+from src.config import config
+
+if TYPE_CHECKING:
+    from structlog.stdlib import BoundLogger
+
+logger: "BoundLogger" = getLogger("search")
+
+OP_INDEX = "index"
+OP_DELETE = "delete"
+
+# (id, _source, {字段: [高亮片段]})
+Hit = tuple[int, dict[str, Any], dict[str, list[str]]]
+
+
+class BaseBackend(ABC):
+    @abstractmethod
+    def create_index(self, index: str, properties: dict[str, Any], force: bool = False) -> None:
+        """创建索引, properties 为需要搜索的字段及其 mapping."""
+
+    @abstractmethod
+    def bulk(
+        self,
+        index: str,
+        actions: Iterable[dict[str, Any]],
+        chunk_size: int | None = None,
+        max_chunk_bytes: int | None = None,
+        thread_count: int | None = None,
+    ) -> tuple[int, int]:
+        """批量写入, 返回 (成功数, 失败数), 删除不存在的文档不算失败.
+
+        返回时写入的文档必须已经可以被搜索到, 之后才会使搜索缓存失效.
+        """
+
+    @abstractmethod
+    def search(
+        self,
+        index: str,
+        q: str,
+        fields: list[str],
+        page: int,
+        count: int,
+        ids: Iterable[int] | None = None,
+        highlight: dict[str, Any] | None = None,
+        source: bool | list[str] = False,
+    ) -> tuple[int, list[Hit]]:
+        """在 fields 中搜索 q, 返回 (total, [hit]), page 从 1 开始."""
+
+    def index(self, index: str, id: int, document: dict[str, Any]) -> None:
+        self.bulk(index, [{"_op_type": OP_INDEX, "_id": id, "_source": document}])
+
+    def delete(self, index: str, id: int) -> None:
+        self.bulk(index, [{"_op_type": OP_DELETE, "_id": id}])
+
+
+class ESBackend(BaseBackend):
+    def __init__(self, es: Elasticsearch) -> None:
+        self.es = es
+        # 已确认存在的索引, 避免每次写入前都请求 indices.exists
+        self._existing_indices: set[str] = set()
+
+    def create_index(self, index: str, properties: dict[str, Any], force: bool = False) -> None:
+        if not force and index in self._existing_indices:
+            return
+        if not self.es.indices.exists(index=index):
+            # 未声明的字段(列表字段)只保存在 _source 中, 不建立索引
+            self.es.indices.create(index=index, mappings={"dynamic": False, "properties": properties})
+        self._existing_indices.add(index)
+
+    # 写入后等待下一次 refresh 再返回, 否则使缓存失效后的查询仍会读到旧结果并缓存到新版本下
+    def index(self, index: str, id: int, document: dict[str, Any]) -> None:
+        self.es.index(index=index, id=str(id), document=document, refresh="wait_for")
+
+    def delete(self, index: str, id: int) -> None:
+        try:
+            self.es.delete(index=index, id=str(id), refresh="wait_for")
+        except NotFoundError:
+            pass
+
+    def bulk(
+        self,
+        index: str,
+        actions: Iterable[dict[str, Any]],
+        chunk_size: int | None = None,
+        max_chunk_bytes: int | None = None,
+        thread_count: int | None = None,
+    ) -> tuple[int, int]:
+        """通过 bulk API 分批流式发送, thread_count 大于 1 时使用多个线程并行发送."""
+        actions = ({"_index": index, **action} for action in actions)
+        options: dict[str, Any] = {
+            "chunk_size": chunk_size or config.ES_BULK_CHUNK_SIZE,
+            "max_chunk_bytes": max_chunk_bytes or config.ES_BULK_MAX_BYTES,
+            "raise_on_error": False,
+            "ignore_status": (404,),
+        }
+        thread_count = thread_count or config.ES_BULK_THREADS
+        if thread_count > 1:
+            results = helpers.parallel_bulk(self.es, actions, thread_count=thread_count, **options)
+        else:
+            results = helpers.streaming_bulk(self.es, actions, **options)
+        success, failed = 0, 0
+        for ok, item in results:
+            if ok:
+                success += 1
+            else:
+                failed += 1
+                logger.warning("bulk index failed", index=index, item=item)
+        if success:
+            # 整批写完后刷新一次, 比每个请求 wait_for 开销小
+            self.es.indices.refresh(index=index)
+        return success, failed
+
+    def search(
+        self,
+        index: str,
+        q: str,
+        fields: list[str],
+        page: int,
+        count: int,
+        ids: Iterable[int] | None = None,
+        highlight: dict[str, Any] | None = None,
+        source: bool | list[str] = False,
+    ) -> tuple[int, list[Hit]]:
+        options: dict[str, Any] = {}
+        if highlight is not None:
+            options["highlight"] = highlight
+        # source 只接受 bool 或映射, 字段列表通过 source_includes 传递
+        if isinstance(source, list):
+            options["source_includes"] = source
+        else:
+            options["source"] = source
+        result = self.es.search(
+            index=index,
+            query=self._query(q, fields, ids),
+            from_=(page - 1) * count,
+            size=count,
+            **options,
+        )
+        hits = [(int(hit["_id"]), hit.get("_source", {}), hit.get("highlight", {})) for hit in result["hits"]["hits"]]
+        return result["hits"]["total"]["value"], hits
+
+    def _query(self, q: str, fields: list[str], ids: Iterable[int] | None = None) -> dict[str, Any]:
+        query: dict[str, Any] = {
+            "multi_match": {
+                "query": q,
+                "fields": fields,
+            }
+        }
+        if ids is None:
+            return query
+        # 查询指定文档
+        return {
+            "bool": {
+                "must": query,
+                "filter": {
+                    "ids": {
+                        "values": list(ids),
+                    }
+                },
+            }
+        }
@@ -0,0 +1,463 @@
+"""进程内倒排索引.
+
+- 分词: 字母和数字按单词切分并转为小写, 中日韩文字按相邻两个字切分(bigram), 单独的一个字保留单字。
+- 倒排表: 每个词对应两个 array, 分别保存文档序号和词频, 文档序号只会递增, 追加即有序。
+- 删除只标记文档序号失效, 失效文档超过一定比例时重建倒排表; 更新即删除后重新添加。
+- 评分: BM25, 多个字段合并为一个字段计算。
+- 持久化: 写入追加到日志 `<dir>/<index>.log`, 日志超过快照大小时合并保存为快照 `<dir>/<index>.idx` 并清空日志;
+  加载时读取快照并重放日志。
+- 多进程: 写入时持有 `<dir>/<index>.lock` 的排他锁, 先读取其他进程写入的变更再追加, 不会互相覆盖;
+  搜索前按快照和日志的变化读取其他进程(如任务队列)写入的变更。
+"""
+import fcntl
+import heapq
+import math
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+from .backend import OP_DELETE, OP_INDEX, BaseBackend, Hit
+
+TOKEN_RE = re.compile(r"[0-9A-Za-z]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+# BM25 参数
+K1 = 1.2
+B = 0.75
+# 失效文档占比超过该值时重建倒排表
+COMPACT_RATIO = 0.25
+SNAPSHOT_MAGIC = b"IIDX1\n"
+# 日志小于该大小时不合并为快照
+LOG_COMPACT_BYTES = 1 << 20
+
+
+def tokenize(text: str) -> list[tuple[str, int, int]]:
+    """分词, 返回 [(词, 起始位置, 结束位置)]."""
+    tokens = []
+    for match in TOKEN_RE.finditer(text):
+        word, start = match.group(), match.start()
+        if word.isascii():
+            tokens.append((word.lower(), start, match.end()))
+        elif len(word) == 1:
+            tokens.append((word, start, start + 1))
+        else:
+            tokens.extend((word[i : i + 2], start + i, start + i + 2) for i in range(len(word) - 1))
+    return tokens
+
+
+def highlight(
+    text: str, terms: set[str], pre_tag: str, post_tag: str, fragment_size: int = 100, number_of_fragments: int = 0
+) -> list[str]:
+    """给 text 中命中的词加上标签, number_of_fragments 为 0 时返回整个字段, 没有命中时返回空列表."""
+    spans = _match_spans(text, terms)
+    if not spans:
+        return []
+    if number_of_fragments == 0:
+        return [_mark(text, spans, 0, len(text), pre_tag, post_tag)]
+    return [
+        _mark(text, spans, lo, hi, pre_tag, post_tag)
+        for lo, hi in _fragment_windows(spans, len(text), fragment_size, number_of_fragments)
+    ]
+
+
+def _match_spans(text: str, terms: set[str]) -> list[list[int]]:
+    """命中的词在 text 中的位置 [start, end), 重叠的合并为一个."""
+    spans: list[list[int]] = []
+    for token, start, end in tokenize(text):
+        if token not in terms:
+            continue
+        # 合并重叠的 bigram, 如 "中文分词" 的 "中文"、"文分"、"分词"
+        if spans and start <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], end)
+        else:
+            spans.append([start, end])
+    return spans
+
+
+def _mark(text: str, spans: list[list[int]], lo: int, hi: int, pre_tag: str, post_tag: str) -> str:
+    """text[lo:hi] 中命中的部分加上标签."""
+    parts, position = [], lo
+    for start, end in spans:
+        if end <= lo or start >= hi:
+            continue
+        left, right = max(start, lo), min(end, hi)
+        parts += [text[position:left], pre_tag, text[left:right], post_tag]
+        position = right
+    parts.append(text[position:hi])
+    return "".join(parts)
+
+
+def _fragment_windows(spans: list[list[int]], length: int, fragment_size: int, number: int) -> list[tuple[int, int]]:
+    """以命中位置为中心的片段范围, 已被前一个片段覆盖的命中不再单独生成片段."""
+    windows: list[tuple[int, int]] = []
+    covered = 0
+    for start, end in spans:
+        if start < covered:
+            continue
+        lo = max(0, start - (fragment_size - (end - start)) // 2)
+        hi = min(length, lo + fragment_size)
+        windows.append((lo, hi))
+        covered = hi
+        if len(windows) >= number:
+            break
+    return windows
+
+
+class InvertedIndex:
+    def __init__(self, fields: Iterable[str]) -> None:
+        self.fields = list(fields)
+        self.doc_ids = array("q")  # 文档序号 -> id
+        self.lengths = array("I")  # 文档序号 -> 词数
+        self.alive = bytearray()  # 文档序号 -> 是否有效
+        self.numbers: dict[int, int] = {}  # id -> 文档序号
+        self.sources: dict[int, dict[str, Any]] = {}  # id -> _source
+        self.postings: dict[str, tuple[array[int], array[int]]] = {}  # 词 -> (文档序号, 词频)
+        self.df: dict[str, int] = {}  # 词 -> 有效文档数
+        self.total_length = 0
+        self.deleted = 0
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def terms(self, source: dict[str, Any]) -> Counter[str]:
+        return Counter(
+            token for field in self.fields if source.get(field) for token, _, _ in tokenize(str(source[field]))
+        )
+
+    def add(self, id: int, source: dict[str, Any]) -> None:
+        """添加文档, id 已存在时替换."""
+        self.delete(id)
+        # 与 Elasticsearch 一样, _source 保存的是 JSON 化之后的值
+        source = orjson.loads(orjson.dumps(source))
+        counts = self.terms(source)
+        length = sum(counts.values())
+        number = len(self.doc_ids)
+        self.doc_ids.append(id)
+        self.lengths.append(length)
+        self.alive.append(1)
+        for term, tf in counts.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = (array("I"), array("I"))
+            posting[0].append(number)
+            posting[1].append(tf)
+            self.df[term] = self.df.get(term, 0) + 1
+        self.numbers[id] = number
+        self.sources[id] = source
+        self.total_length += length
+
+    def delete(self, id: int) -> bool:
+        """删除文档, 返回文档是否存在."""
+        number = self.numbers.pop(id, None)
+        if number is None:
+            return False
+        for term in self.terms(self.sources.pop(id)):
+            self.df[term] -= 1
+        self.alive[number] = 0
+        self.total_length -= self.lengths[number]
+        self.deleted += 1
+        if self.deleted > len(self.doc_ids) * COMPACT_RATIO:
+            self.compact()
+        return True
+
+    def compact(self) -> None:
+        """去掉失效的文档, 重新编号并重建倒排表."""
+        mapping = array("q", [-1]) * len(self.doc_ids)
+        doc_ids, lengths = array("q"), array("I")
+        for number, alive in enumerate(self.alive):
+            if alive:
+                mapping[number] = len(doc_ids)
+                doc_ids.append(self.doc_ids[number])
+                lengths.append(self.lengths[number])
+        postings: dict[str, tuple[array[int], array[int]]] = {}
+        for term, (numbers, tfs) in self.postings.items():
+            new_numbers, new_tfs = array("I"), array("I")
+            for number, tf in zip(numbers, tfs, strict=True):
+                if self.alive[number]:
+                    new_numbers.append(mapping[number])
+                    new_tfs.append(tf)
+            if new_numbers:
+                postings[term] = (new_numbers, new_tfs)
+        self.doc_ids, self.lengths, self.postings = doc_ids, lengths, postings
+        self.alive = bytearray(b"\x01") * len(doc_ids)
+        self.numbers = {id: number for number, id in enumerate(doc_ids)}
+        self.df = {term: df for term, df in self.df.items() if df > 0}
+        self.deleted = 0
+
+    def search(self, q: str, offset: int, size: int, ids: Iterable[int] | None = None) -> tuple[int, list[int]]:
+        """BM25 排序, 任意一个词命中即可, 返回 (total, [id])."""
+        terms = {token for token, _, _ in tokenize(q)}
+        total_docs = len(self.numbers)
+        if not terms or not total_docs:
+            return 0, []
+        allowed = None if ids is None else {self.numbers[id] for id in ids if id in self.numbers}
+        avgdl = self.total_length / total_docs or 1
+        scores: dict[int, float] = {}
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            df = self.df[term]
+            idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            for number, tf in zip(*posting, strict=True):
+                if not self.alive[number] or (allowed is not None and number not in allowed):
+                    continue
+                norm = tf + K1 * (1 - B + B * self.lengths[number] / avgdl)
+                scores[number] = scores.get(number, 0.0) + idf * tf * (K1 + 1) / norm
+        # 分数相同时先添加的文档在前
+        top = heapq.nlargest(offset + size, scores.items(), key=lambda item: (item[1], -item[0]))
+        return len(scores), [self.doc_ids[number] for number, _ in top[offset:]]
+
+    def save(self, path: Path) -> None:
+        """保存快照, 先写临时文件再替换, 读取方不会读到写了一半的文件."""
+        if self.deleted:
+            self.compact()
+        terms = list(self.postings)
+        numbers, tfs = array("I"), array("I")
+        for term in terms:
+            numbers.extend(self.postings[term][0])
+            tfs.extend(self.postings[term][1])
+        header = orjson.dumps(
+            {
+                "byteorder": sys.byteorder,
+                "fields": self.fields,
+                "sources": [self.sources[id] for id in self.doc_ids],
+                "terms": [[term, len(self.postings[term][0]), self.df[term]] for term in terms],
+            }
+        )
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack("<QQ", len(header), len(numbers)))
+            f.write(header)
+            for data in (self.doc_ids, self.lengths, numbers, tfs):
+                data.tofile(f)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "InvertedIndex":
+        with path.open("rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError(f"无效的索引快照: {path}")
+            header_size, posting_size = struct.unpack("<QQ", f.read(16))
+            header = orjson.loads(f.read(header_size))
+            doc_count = len(header["sources"])
+            doc_ids, lengths, numbers, tfs = array("q"), array("I"), array("I"), array("I")
+            for data, size in (
+                (doc_ids, doc_count),
+                (lengths, doc_count),
+                (numbers, posting_size),
+                (tfs, posting_size),
+            ):
+                data.fromfile(f, size)
+                if header["byteorder"] != sys.byteorder:
+                    data.byteswap()
+        index = cls(header["fields"])
+        index.doc_ids, index.lengths = doc_ids, lengths
+        index.alive = bytearray(b"\x01") * doc_count
+        index.numbers = {id: number for number, id in enumerate(doc_ids)}
+        index.sources = dict(zip(doc_ids, header["sources"], strict=True))
+        index.total_length = sum(lengths)
+        position = 0
+        for term, size, df in header["terms"]:
+            index.postings[term] = (numbers[position : position + size], tfs[position : position + size])
+            index.df[term] = df
+            position += size
+        return index
+
+
+def _file_id(path: Path) -> tuple[int, int] | None:
+    """文件的 (inode, 修改时间), 替换或修改后会变化, 文件不存在时为 None."""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _file_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+class InvertedIndexBackend(BaseBackend):
+    def __init__(self, path: str | Path, reload_interval: float = 1.0) -> None:
+        self.path = Path(path)
+        self.reload_interval = reload_interval
+        self.indices: dict[str, InvertedIndex] = {}
+        # 已加载的快照和已重放的日志字节数
+        self._snapshots: dict[str, tuple[int, int] | None] = {}
+        self._offsets: dict[str, int] = {}
+        self._checked: dict[str, float] = {}
+        self._lock = threading.RLock()
+
+    def snapshot_path(self, index: str) -> Path:
+        return self.path / f"{index}.idx"
+
+    def log_path(self, index: str) -> Path:
+        return self.path / f"{index}.log"
+
+    def create_index(self, index: str, properties: dict[str, Any], force: bool = False) -> None:
+        with self._lock:
+            if force or index not in self.indices:
+                self.indices.pop(index, None)
+                with self._file_lock(index, exclusive=False):
+                    self._refresh(index, list(properties))
+
+    def bulk(
+        self,
+        index: str,
+        actions: Iterable[dict[str, Any]],
+        chunk_size: int | None = None,
+        max_chunk_bytes: int | None = None,
+        thread_count: int | None = None,
+    ) -> tuple[int, int]:
+        """在内存中写入后追加到日志, 分批和并行参数对内存索引没有意义."""
+        with self._lock:
+            inverted = self.indices.get(index)
+            if inverted is None:
+                raise Exception(f"索引 {index} 不存在, 请先调用 create_index")
+            with self._file_lock(index, exclusive=True):
+                # 先读取其他进程的写入, 再在此基础上修改
+                self._refresh(index, inverted.fields)
+                inverted = self.indices[index]
+                lines = []
+                for action in actions:
+                    entry: dict[str, Any] = {
+                        key: action[key] for key in ("_op_type", "_id", "_source") if key in action
+                    }
+                    self._apply(inverted, entry)
+                    lines.append(orjson.dumps(entry))
+                if lines:
+                    self._append(index, lines)
+        return len(lines), 0
+
+    def search(
+        self,
+        index: str,
+        q: str,
+        fields: list[str],
+        page: int,
+        count: int,
+        ids: Iterable[int] | None = None,
+        highlight: dict[str, Any] | None = None,
+        source: bool | list[str] = False,
+    ) -> tuple[int, list[Hit]]:
+        with self._lock:
+            if index not in self.indices:
+                with self._file_lock(index, exclusive=False):
+                    self._refresh(index, fields)
+            else:
+                self._reload_if_changed(index)
+            inverted = self.indices[index]
+            total, result_ids = inverted.search(q, (page - 1) * count, count, ids)
+            sources = [inverted.sources[id] for id in result_ids]
+        terms = {token for token, _, _ in tokenize(q)}
+        hits: list[Hit] = []
+        for id, document in zip(result_ids, sources, strict=True):
+            if source is True:
+                selected = document
+            elif source is False:
+                selected = {}
+            else:
+                selected = {field: document[field] for field in source if field in document}
+            hits.append((id, selected, self._highlight(document, terms, highlight)))
+        return total, hits
+
+    def _highlight(
+        self, document: dict[str, Any], terms: set[str], options: dict[str, Any] | None
+    ) -> dict[str, list[str]]:
+        if options is None:
+            return {}
+        result = {}
+        for field in options.get("fields", {}):
+            if not document.get(field):
+                continue
+            fragments = highlight(
+                str(document[field]),
+                terms,
+                options.get("pre_tags", ["<em>"])[0],
+                options.get("post_tags", ["</em>"])[0],
+                options.get("fragment_size", 100),
+                options.get("number_of_fragments", 5),
+            )
+            if fragments:
+                result[field] = fragments
+        return result
+
+    @contextmanager
+    def _file_lock(self, index: str, exclusive: bool) -> Iterator[None]:
+        """跨进程的读写锁, 写入时排他, 读取快照和日志时共享."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        with (self.path / f"{index}.lock").open("a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _apply(inverted: InvertedIndex, action: dict[str, Any]) -> None:
+        if action["_op_type"] == OP_DELETE:
+            inverted.delete(int(action["_id"]))
+        elif action["_op_type"] == OP_INDEX:
+            inverted.add(int(action["_id"]), action["_source"])
+
+    def _refresh(self, index: str, fields: list[str]) -> None:
+        """读取磁盘上的变更: 快照变化时重新加载, 之后重放尚未读取的日志, 需要持有文件锁."""
+        path = self.snapshot_path(index)
+        snapshot = _file_id(path)
+        if index not in self.indices or snapshot != self._snapshots.get(index):
+            self.indices[index] = InvertedIndex(fields) if snapshot is None else InvertedIndex.load(path)
+            self._snapshots[index] = snapshot
+            self._offsets[index] = 0
+        self._checked[index] = time.monotonic()
+        try:
+            with self.log_path(index).open("rb") as f:
+                f.seek(self._offsets[index])
+                data = f.read()
+        except FileNotFoundError:
+            return
+        inverted = self.indices[index]
+        for line in data.splitlines():
+            self._apply(inverted, orjson.loads(line))
+        self._offsets[index] += len(data)
+
+    def _append(self, index: str, lines: list[bytes]) -> None:
+        """追加日志, 日志超过快照大小时保存快照, 需要持有排他锁."""
+        with self.log_path(index).open("ab") as f:
+            f.write(b"\n".join(lines) + b"\n")
+            size = f.tell()
+        self._offsets[index] = size
+        if size >= max(LOG_COMPACT_BYTES, _file_size(self.snapshot_path(index))):
+            self._save(index)
+
+    def _save(self, index: str) -> None:
+        path = self.snapshot_path(index)
+        self.indices[index].save(path)
+        # 快照替换后、日志删除前崩溃时, 重放已包含在快照中的日志结果不变
+        self.log_path(index).unlink(missing_ok=True)
+        self._snapshots[index] = _file_id(path)
+        self._offsets[index] = 0
+
+    def _reload_if_changed(self, index: str) -> None:
+        now = time.monotonic()
+        if now - self._checked.get(index, 0) < self.reload_interval:
+            return
+        self._checked[index] = now
+        changed = _file_id(self.snapshot_path(index)) != self._snapshots.get(index)
+        if changed or _file_size(self.log_path(index)) != self._offsets.get(index):
+            with self._file_lock(index, exclusive=False):
+                self._refresh(index, self.indices[index].fields)
@@ -0,0 +1,401 @@
+"""全文搜索.
+
+索引的读写由搜索后端完成(见 backend.py), 配置 SEARCH_BACKEND 选择 Elasticsearch 或进程内倒排索引.
+模型写入时不直接请求 ES, 而是在事务提交后把 (模型, id, 操作) 写入 hash `search:sync`,
+同一 id 在窗口期内的多次变更只保留最后一次, 由任务队列的 sync_search_index 批量写入索引.
+列表字段保存在 _source 中, search_source 直接用 ES 的结果组成列表并缓存, 索引写入后缓存失效.
+"""
+import hashlib
+from collections.abc import Iterable, Iterator, Sequence
+from datetime import timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, ClassVar
+from uuid import uuid4
+
+import orjson
+from elasticsearch import Elasticsearch
+from flask import Flask
+from redis.exceptions import ResponseError
+from sqlalchemy import case, event, select
+from sqlalchemy.orm import Session, object_session
+from structlog import getLogger
+
+from src.common.cache import BaseNode, JSONSerializer, cache
+from src.common.db import session
+from src.common.redis import redis, storage
+from src.common.timing import TimedNode
+from src.config import config
+
+from .backend import OP_DELETE, OP_INDEX, BaseBackend, ESBackend, Hit
+from .inverted import InvertedIndexBackend
+
+if TYPE_CHECKING:
+    from structlog.stdlib import BoundLogger
+
+logger: "BoundLogger" = getLogger("search")
+
+SYNC_KEY = "search:sync"
+# 每次同步取走变更时使用不同的 key, 并发或残留的同步任务不会互相覆盖
+SYNC_PROCESSING_KEY = "search:sync:processing:{}"
+# 同步任务崩溃时处理中的变更保留的时间, 可以手动放回 SYNC_KEY
+SYNC_PROCESSING_TTL = 60 * 60 * 24
+SYNC_SCHEDULED_KEY = "search:sync:scheduled"
+SYNC_INFO_KEY = "search_changes"
+# 处理失败的变更放回队列并删除处理中的 key, 队列中已有更新的变更优先
+_restore_changes = redis.register_script("""
+    local pending = redis.call('hgetall', KEYS[2])
+    for i = 1, #pending, 2 do
+        redis.call('hsetnx', KEYS[1], pending[i], pending[i + 1])
+    end
+    redis.call('del', KEYS[2])
+    return #pending / 2
+    """)
+
+
+class Searchable:
+    model: type[Any]
+    # 默认为模型的表名
+    index_name: ClassVar[str]
+    __searchable__: Iterable[tuple[str, bool]] = set()
+    # 只保存在 _source 中的列表字段(不参与搜索), 列表页可以直接使用 ES 的结果, 不再查询数据库
+    __source__: Iterable[str] = ()
+    # 模型名 -> Searchable 子类, 任务队列根据模型名找到对应的索引
+    registry: ClassVar[dict[str, type["Searchable"]]] = {}
+
+    zh_field_properties: dict[str, str] = {
+        "type": "text",
+        "analyzer": "ik_max_word",
+        "search_analyzer": "ik_max_word",
+    }  # 中文分词
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        model = getattr(cls, "model", None)
+        if model is not None and "index_name" not in cls.__dict__:
+            cls.index_name = str(model.__tablename__)
+        # 每个模型只注册一次监听, 与实例化次数无关
+        if model is not None and model.__name__ not in cls.registry:
+            cls.registry[model.__name__] = cls
+            cls.listen()
+
+    def __init__(self) -> None:
+        if es.backend is None:
+            raise Exception("请先在 app 中实例化 es 插件")
+        self.backend: BaseBackend = es.backend
+        if not hasattr(self.model, "id"):
+            raise Exception("model 必须有 id 字段")
+
+    def create_index(self, force: bool = False) -> None:
+        """获得当前模型索引, 后端会缓存已存在的索引, force 为 True 时重新检查."""
+        properties: dict[str, Any] = {}
+        for field, _ in self.__searchable__:
+            properties[field] = self.zh_field_properties
+        self.backend.create_index(self.index_name, properties, force)
+
+    def document(self, obj: Any) -> dict[str, Any]:
+        """模型中需要索引和保存到 _source 的字段."""
+        return {field: getattr(obj, field) for field in self.source_fields()}
+
+    def source_fields(self) -> list[str]:
+        return [field for field, _ in self.__searchable__] + list(self.__source__)
+
+    def invalidate(self) -> None:
+        """索引写入后递增版本号, 使该索引的搜索缓存失效."""
+        SearchPage.invalidate(self.model.__name__)
+
+    def add_obj_index(self, obj: Any) -> None:
+        """添加模型索引."""
+        self.create_index()
+        self.backend.index(self.index_name, obj.id, self.document(obj))
+        self.invalidate()
+
+    def actions(self, objs: Iterable[Any]) -> Iterator[dict[str, Any]]:
+        """生成 bulk 请求的 index 操作."""
+        for obj in objs:
+            yield {"_op_type": OP_INDEX, "_id": obj.id, "_source": self.document(obj)}
+
+    def bulk_index(
+        self,
+        objs: Iterable[Any],
+        chunk_size: int | None = None,
+        max_chunk_bytes: int | None = None,
+        thread_count: int | None = None,
+    ) -> tuple[int, int]:
+        """通过 bulk API 批量添加模型索引, 返回 (成功数, 失败数).
+
+        objs 按 chunk_size 条或 max_chunk_bytes 字节分批流式发送, 不会一次性读入内存;
+        thread_count 大于 1 时使用多个线程并行发送.
+        """
+        return self.bulk(self.actions(objs), chunk_size, max_chunk_bytes, thread_count)
+
+    def bulk(
+        self,
+        actions: Iterable[dict[str, Any]],
+        chunk_size: int | None = None,
+        max_chunk_bytes: int | None = None,
+        thread_count: int | None = None,
+    ) -> tuple[int, int]:
+        """发送 bulk 请求, 删除不存在的文档不算失败."""
+        self.create_index()
+        success, failed = self.backend.bulk(self.index_name, actions, chunk_size, max_chunk_bytes, thread_count)
+        if success:
+            self.invalidate()
+        return success, failed
+
+    def remove_obj_index(self, obj: Any) -> None:
+        """删除模型索引."""
+        self.create_index()
+        self.backend.delete(self.index_name, obj.id)
+        self.invalidate()
+
+    def highlight_options(self) -> dict[str, Any]:
+        """ES 服务端高亮设置, 只高亮标记为 True 的字段."""
+        fields: dict[str, dict[str, Any]] = {
+            field: {} for field, need_highlight in self.__searchable__ if need_highlight
+        }
+        return {
+            "pre_tags": [config.ES_HIGHLIGHT_PRE_TAG],
+            "post_tags": [config.ES_HIGHLIGHT_POST_TAG],
+            "fragment_size": config.ES_HIGHLIGHT_FRAGMENT_SIZE,
+            "number_of_fragments": config.ES_HIGHLIGHT_FRAGMENTS,
+            "fields": fields,
+        }
+
+    def query_obj_index(self, q: str, page: int, count: int, ids: Iterable[int] | None = None) -> tuple[int, list[int]]:
+        """按条件查询.
+
+        q: 要查询的字段
+        page: 默认1
+        count: 默认10
+        ids: 指定查询范围
+        """
+        total, hits = self.highlight_obj_index(q, page, count, ids, highlight=False)
+        return total, [id for id, _ in hits]  # (total, [id])
+
+    def highlight_obj_index(
+        self, q: str, page: int, count: int, ids: Iterable[int] | None = None, highlight: bool = True
+    ) -> tuple[int, list[tuple[int, dict[str, list[str]]]]]:
+        """按条件查询, 同时由后端返回高亮片段: (total, [(id, {字段: [高亮片段]})])."""
+        total, hits = self._search(q, page, count, ids, highlight)
+        return total, [(id, fragments) for id, _, fragments in hits]
+
+    def query_source(
+        self, q: str, page: int, count: int, ids: Iterable[int] | None = None
+    ) -> tuple[int, list[dict[str, Any]]]:
+        """按条件查询, 直接使用 _source 中的字段和高亮片段组成列表, 不查询数据库."""
+        total, hits = self._search(q, page, count, ids, source=self.source_fields())
+        items: list[dict[str, Any]] = []
+        for id, source, highlights in hits:
+            item: dict[str, Any] = {**source, "id": id}
+            for field, fragments in highlights.items():
+                item[field] = config.ES_HIGHLIGHT_SEPARATOR.join(fragments)
+            items.append(item)
+        return total, items
+
+    def search_source(
+        self, q: str, page: int, count: int, ids: Iterable[int] | None = None
+    ) -> tuple[int, list[dict[str, Any]]]:
+        """带缓存的 query_source, 相同的查询在缓存有效期内不再请求 ES."""
+        node = cache.get(
+            SearchPage(
+                name=self.model.__name__,
+                q=q,
+                page=page,
+                count=count,
+                ids=None if ids is None else sorted(ids),
+            )
+        )
+        return node.total, node.items  # type: ignore[union-attr]
+
+    def _search(
+        self,
+        q: str,
+        page: int,
+        count: int,
+        ids: Iterable[int] | None = None,
+        highlight: bool = True,
+        source: bool | list[str] = False,
+    ) -> tuple[int, list[Hit]]:
+        return self.backend.search(
+            self.index_name,
+            q,
+            [field for field, _ in self.__searchable__],
+            page,
+            count,
+            ids,
+            highlight=self.highlight_options() if highlight else None,
+            source=source,
+        )
+
+    def search(self, q: str, page: int, count: int, ids: Iterable[int] | None = None) -> tuple[int, Sequence[Any]]:
+        """query_boj_index 的抽象."""
+        total, hits = self.highlight_obj_index(q, page, count, ids)
+        if total == 0:
+            # 没有记录
+            return 0, []
+        result_ids = [id for id, _ in hits]
+        highlights = dict(hits)
+        when = {result_id: i for i, result_id in enumerate(result_ids)}
+        # https://stackoverflow.com/questions/6332043/sql-order-by-multiple-values-in-specific-order/6332081#6332081
+        with session:
+            result: Sequence[Any] = session.scalars(
+                select(self.model).filter(self.model.id.in_(result_ids)).order_by(case(when, value=self.model.id))
+            ).all()
+            # 用 ES 返回的高亮片段替换字段值, 没有命中的字段保持原值
+            for obj in result:
+                session.expunge(obj)  # 避免高亮后的值被写回数据库
+                for field, fragments in highlights[obj.id].items():
+                    setattr(obj, field, config.ES_HIGHLIGHT_SEPARATOR.join(fragments))
+
+            return total, result
+
+    def reindex(self, chunk_size: int | None = None) -> tuple[int, int]:
+        """reindex 所有模型数据, 按批从数据库流式读取并批量写入索引."""
+        chunk_size = chunk_size or config.ES_BULK_CHUNK_SIZE
+        self.create_index(force=True)
+        with session:
+            result = session.scalars(select(self.model).execution_options(yield_per=chunk_size))
+            return self.bulk_index(result, chunk_size=chunk_size)
+
+    def apply(self, changes: dict[int, str]) -> tuple[int, int]:
+        """将排队的变更写入索引: 仍存在的行重新索引, 已删除的行删除文档."""
+        index_ids = [id for id, op in changes.items() if op == OP_INDEX]
+        chunk_size = config.ES_BULK_CHUNK_SIZE
+        actions: list[dict[str, Any]] = []
+        found: set[int] = set()
+        with session:
+            for i in range(0, len(index_ids), chunk_size):
+                objs = session.scalars(select(self.model).where(self.model.id.in_(index_ids[i : i + chunk_size])))
+                for action in self.actions(objs):
+                    found.add(action["_id"])
+                    actions.append(action)
+        # 提交后又被删除的行同样删除文档
+        actions.extend({"_op_type": OP_DELETE, "_id": id} for id in changes if id not in found)
+        return self.bulk(actions)
+
+    @classmethod
+    def listen(cls) -> None:
+        """sqlalchemy 监听事件注册, 只记录变更, 提交后统一入队."""
+        name = cls.model.__name__
+
+        def record(target: Any, op: str) -> None:
+            db_session = object_session(target)
+            if db_session is not None:
+                db_session.info.setdefault(SYNC_INFO_KEY, {})[f"{name}:{target.id}"] = op
+
+        # update 不一定真正修改了索引字段, 由窗口期合并后统一重新索引
+        event.listen(cls.model, "after_insert", lambda mapper, connection, target: record(target, OP_INDEX))
+        event.listen(cls.model, "after_update", lambda mapper, connection, target: record(target, OP_INDEX))
+        event.listen(cls.model, "after_delete", lambda mapper, connection, target: record(target, OP_DELETE))
+
+    @classmethod
+    def enqueue(cls, changes: dict[str | bytes, str | bytes | int | float]) -> None:
+        """变更写入队列, 窗口期内只调度一次同步任务, changes 为 {"模型名:id": 操作}."""
+        redis.hset(SYNC_KEY, mapping=changes)
+        cls.schedule()
+
+    @classmethod
+    def schedule(cls) -> None:
+        if redis.set(SYNC_SCHEDULED_KEY, 1, nx=True, ex=60):
+            # 任务模块依赖 create_app, 在这里导入避免循环引用
+            from src.common.task import sync_search_index  # noqa: PLC0415
+
+            sync_search_index.delay(eta=timedelta(seconds=config.ES_SYNC_WINDOW))
+
+    @classmethod
+    def sync(cls) -> int:
+        """批量应用队列中的所有变更, 返回处理的变更数量."""
+        # 先取走当前的变更, 处理期间的新变更写入新的 hash, 由下一个任务处理
+        processing_key = SYNC_PROCESSING_KEY.format(uuid4().hex)
+        pipe = redis.pipeline()
+        pipe.rename(SYNC_KEY, processing_key)
+        pipe.expire(processing_key, SYNC_PROCESSING_TTL)
+        try:
+            pipe.execute()
+        except ResponseError:  # 队列为空
+            return 0
+        pending = redis.hgetall(processing_key)
+        grouped: dict[str, dict[int, str]] = {}
+        for member, op in pending.items():
+            name, _, id = member.rpartition(":")
+            grouped.setdefault(name, {})[int(id)] = op
+        try:
+            for name, changes in grouped.items():
+                searchable = cls.registry.get(name)
+                if searchable is None:
+                    logger.warning("unknown searchable model", model=name)
+                    continue
+                searchable().apply(changes)
+        except Exception:
+            _restore_changes(keys=[SYNC_KEY, processing_key])
+            cls.schedule()
+            raise
+        redis.delete(processing_key)
+        return len(pending)
+
+
+class SearchPage(BaseNode):
+    """搜索结果缓存.
+
+    同一模型的所有查询在一个命名空间下, 索引写入时递增命名空间版本号使其全部失效.
+    """
+
+    name: str
+    q: str = ""
+    page: int = 1
+    count: int = 10
+    ids: list[int] | None = None
+    total: int = 0
+    items: list[dict[str, Any]] = []
+
+    def key(self) -> str:
+        query = orjson.dumps([self.q, self.page, self.count, self.ids])
+        return hashlib.blake2b(query, digest_size=16).hexdigest()
+
+    def namespace(self) -> str:
+        return f"search:{self.name}"
+
+    def load(self) -> Any:
+        total, items = Searchable.registry[self.name]().query_source(self.q, self.page, self.count, self.ids)
+        return {**self.dict(exclude={"total", "items"}), "total": total, "items": items}
+
+    @classmethod
+    def invalidate(cls, name: str) -> None:
+        cache.expire(cls(name=name))
+
+    class Meta:
+        prefix = "search:page:"
+        ttl = timedelta(seconds=config.ES_SEARCH_CACHE_TTL)
+        storage = storage
+        serializer = JSONSerializer()
+
+
+@event.listens_for(Session, "after_commit")
+def _enqueue_search_changes(db_session: Session) -> None:
+    changes: dict[str | bytes, str | bytes | int | float] | None = db_session.info.pop(SYNC_INFO_KEY, None)
+    if changes:
+        Searchable.enqueue(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_search_changes(db_session: Session) -> None:
+    db_session.info.pop(SYNC_INFO_KEY, None)
+
+
+class ES:
+    def __init__(self, app: Flask | None = None) -> None:
+        self.es: Elasticsearch | None = None
+        self.backend: BaseBackend | None = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        if config.SEARCH_BACKEND == "memory":
+            self.backend = InvertedIndexBackend(Path(config.BASE_DIR) / config.SEARCH_INDEX_DIR)
+        else:
+            self.es = Elasticsearch(config.ES_HOST, node_class=TimedNode)
+            self.backend = ESBackend(self.es)
+        app.extensions["es"] = self
+
+
+es = ES()
@@ -0,0 +1,142 @@
+"""慢查询日志.
+
+执行时间超过阈值的语句记录 SQL、参数、请求的 endpoint、调用位置以及 EXPLAIN 结果,
+不需要开启 MySQL 慢查询日志就能发现缺少索引的查询。
+
+同一结构的语句(忽略字面量和 IN 列表长度)每个统计周期只记录一次, EXPLAIN 也只在记录时执行。
+"""
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from flask import has_request_context, request
+from sqlalchemy import Engine, event
+from structlog import getLogger
+
+from src.common.timing import instrument_engine, query_duration
+
+if TYPE_CHECKING:
+    from types import FrameType
+
+    from structlog.stdlib import BoundLogger
+
+logger: "BoundLogger" = getLogger("slow_query")
+
+# 参数的 repr 最多记录的长度
+MAX_PARAMS_LENGTH = 1000
+# 记录时间超过该数量时清理已过期的语句
+MAX_SHAPES = 10000
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+)"
+_IN_LIST = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})*\s*\)")
+
+# 各数据库查看执行计划的语句
+EXPLAIN_PREFIX = {
+    "mysql": "EXPLAIN ",
+    "mariadb": "EXPLAIN ",
+    "postgresql": "EXPLAIN ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+
+# 调用位置跳过这些文件中的帧, 包括模型基类中的查询辅助方法
+_SKIP_FILES = (
+    str(Path(__file__).parent / "db.py"),
+    str(Path(__file__)),
+    str(Path(__file__).parent.parent / "app" / "model" / "base.py"),
+)
+
+
+def shape(statement: str) -> str:
+    """语句的结构, 字面量替换为 ?, 参数列表替换为 (...)."""
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    statement = _STRING.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    return _IN_LIST.sub("(...)", statement)
+
+
+def caller(root: Path) -> str | None:
+    """返回 root 目录中离当前执行位置最近的调用位置."""
+    frame: FrameType | None = sys._getframe(1)
+    prefix = str(root)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(prefix) and filename not in _SKIP_FILES:
+            return f"{filename[len(prefix) + 1:]}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+class SlowQueryLog:
+    """记录 engine 上的慢查询.
+
+    Args:
+        threshold: 超过该时间(秒)的语句视为慢查询。
+        interval: 同一结构的语句在该时间(秒)内只记录一次。
+        explain: 是否记录 SELECT 语句的执行计划。
+        root: 查找调用位置的代码目录。
+    """
+
+    def __init__(
+        self, threshold: float, interval: float = 60.0, explain: bool = True, root: Path | None = None
+    ) -> None:
+        self.threshold = threshold
+        self.interval = interval
+        self.explain = explain
+        self.root = (root or Path(__file__).parent.parent).resolve()
+        self._logged: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def instrument(self, engine: Engine) -> None:
+        """执行时间由 timing 的监听器测量, 这里只读取结果."""
+        instrument_engine(engine)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+    def after_cursor_execute(
+        self, conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool
+    ) -> None:
+        duration = query_duration(conn)
+        if duration is None:
+            return
+        if duration < self.threshold * 1e9 or not self._should_log(shape(statement)):
+            return
+        logger.warning(
+            "slow query",
+            sql=statement,
+            params=repr(parameters)[:MAX_PARAMS_LENGTH],
+            duration=duration,
+            endpoint=request.endpoint if has_request_context() else None,
+            caller=caller(self.root),
+            explain=self._explain(conn, statement, parameters) if self.explain and not executemany else None,
+        )
+
+    def _should_log(self, key: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            last = self._logged.get(key)
+            if last is not None and now - last < self.interval:
+                return False
+            if len(self._logged) >= MAX_SHAPES:
+                self._logged = {k: v for k, v in self._logged.items() if now - v < self.interval}
+            self._logged[key] = now
+            return True
+
+    @staticmethod
+    def _explain(conn: Any, statement: str, parameters: Any) -> list[Any] | str | None:
+        """使用原始 DBAPI cursor 执行 EXPLAIN, 不会再次触发事件."""
+        prefix = EXPLAIN_PREFIX.get(conn.dialect.name)
+        if prefix is None or statement.lstrip()[:6].upper() != "SELECT":
+            return None
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters)
+            return [list(row) for row in cursor.fetchall()]
+        except Exception as e:  # noqa: BLE001
+            return f"explain failed: {e}"
+        finally:
+            cursor.close()
@@ -0,0 +1,15 @@
+from .backplane import BaseBackplane, LocalBackplane, RedisBackplane
+from .presence import Presence, RedisPresence
+from .sock import ConnectionRegistry, Server, Sock, sock
+
+__all__ = (
+    "sock",
+    "Sock",
+    "Server",
+    "ConnectionRegistry",
+    "BaseBackplane",
+    "LocalBackplane",
+    "RedisBackplane",
+    "Presence",
+    "RedisPresence",
+)
@@ -0,0 +1,228 @@
+"""多 worker 间 websocket 消息分发.
+
+每个 gunicorn worker 只持有连接到自身的客户端, 因此 broadcast/send_one 需要经过一个
+发布订阅通道(backplane)转发给所有 worker, 再由各 worker 投递到本地连接:
+
+- 广播消息发布到 `ws:broadcast`, 所有 worker 都订阅。
+- 点对点消息发布到 `ws:user:<user_id>`, 只有该用户有连接的 worker 才订阅。
+
+RedisBackplane 用于生产环境, LocalBackplane 为单进程实现, 用于测试和开发。
+"""
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterable
+from typing import TYPE_CHECKING, Any
+
+import orjson
+from redis import Redis
+from structlog import getLogger
+
+if TYPE_CHECKING:
+    from redis.client import PubSub
+    from structlog.stdlib import BoundLogger
+
+logger: "BoundLogger" = getLogger("ws")
+
+BROADCAST_CHANNEL = "ws:broadcast"
+USER_CHANNEL_PREFIX = "ws:user:"
+
+# (key, 已编码的消息), key 用于发送队列合并同类消息
+Frame = tuple[str | None, str]
+# (channel, [frame]) -> None
+Handler = Callable[[str, list[Frame]], None]
+
+
+def user_channel(user_id: int) -> str:
+    return f"{USER_CHANNEL_PREFIX}{user_id}"
+
+
+def encode_message(message: Any) -> str:
+    """消息统一转换为文本帧内容."""
+    if isinstance(message, str):
+        return message
+    if isinstance(message, bytes | bytearray):
+        return bytes(message).decode()
+    return orjson.dumps(message).decode()
+
+
+class BaseBackplane(ABC):
+    def __init__(self) -> None:
+        self.handler: Handler | None = None
+
+    def set_handler(self, handler: Handler) -> None:
+        """注册本地投递函数."""
+        self.handler = handler
+
+    @abstractmethod
+    def publish(self, channel: str, message: Any, key: str | None = None) -> None:
+        raise NotImplementedError()
+
+    def publish_many(self, channels: Iterable[str], message: Any, key: str | None = None) -> None:
+        for channel in channels:
+            self.publish(channel, message, key)
+
+    @abstractmethod
+    def subscribe(self, channel: str) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def unsubscribe(self, channel: str) -> None:
+        raise NotImplementedError()
+
+    def close(self) -> None:  # noqa: B027
+        """释放资源, 默认无需处理."""
+
+
+class LocalBackplane(BaseBackplane):
+    """单进程实现, 发布即同步投递, 行为可预测, 便于测试."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.channels: set[str] = {BROADCAST_CHANNEL}
+
+    def publish(self, channel: str, message: Any, key: str | None = None) -> None:
+        if self.handler is not None and channel in self.channels:
+            self.handler(channel, [(key, encode_message(message))])
+
+    def subscribe(self, channel: str) -> None:
+        self.channels.add(channel)
+
+    def unsubscribe(self, channel: str) -> None:
+        self.channels.discard(channel)
+
+
+class RedisBackplane(BaseBackplane):
+    """基于 Redis pub/sub 的实现.
+
+    发布的消息先进入缓冲区, 由后台线程每隔 flush_interval 秒(或缓冲区满 max_batch 条时)
+    按 channel 合并成一个 JSON 数组, 通过 pipeline 一次性发布。订阅线程收到后拆开逐条投递。
+
+    线程在首次使用时按进程启动, 避免 gunicorn fork 前启动的线程在子进程中丢失。
+    """
+
+    def __init__(
+        self,
+        url: str,
+        flush_interval: float = 0.01,
+        max_batch: int = 500,
+    ) -> None:
+        super().__init__()
+        self.url = url
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        self._redis: "Redis[bytes] | None" = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+        self._buffer: list[tuple[str, Frame]] = []
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        # 订阅变更在订阅线程中执行, PubSub 对象只在该线程内使用
+        self._pending: list[tuple[bool, str]] = []
+        self._channels: set[str] = {BROADCAST_CHANNEL}
+
+    @property
+    def redis(self) -> "Redis[bytes]":
+        self._ensure_started()
+        return self._redis  # type: ignore[return-value]
+
+    def _ensure_started(self) -> None:
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._redis = Redis.from_url(self.url)
+            self._buffer.clear()
+            self._stopped.clear()
+            threading.Thread(target=self._listen, name="ws-backplane-sub", daemon=True).start()
+            threading.Thread(target=self._flush_loop, name="ws-backplane-pub", daemon=True).start()
+            self._pid = pid
+
+    def publish(self, channel: str, message: Any, key: str | None = None) -> None:
+        self.publish_many((channel,), message, key)
+
+    def publish_many(self, channels: Iterable[str], message: Any, key: str | None = None) -> None:
+        self._ensure_started()
+        # 只序列化一次
+        frame = (key, encode_message(message))
+        with self._lock:
+            self._buffer.extend((channel, frame) for channel in channels)
+            full = len(self._buffer) >= self.max_batch
+        if full:
+            self._wakeup.set()
+
+    def subscribe(self, channel: str) -> None:
+        self._ensure_started()
+        with self._lock:
+            self._channels.add(channel)
+            self._pending.append((True, channel))
+
+    def unsubscribe(self, channel: str) -> None:
+        with self._lock:
+            self._channels.discard(channel)
+            self._pending.append((False, channel))
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+
+    def flush(self) -> None:
+        """立即发布缓冲区中的消息."""
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+        if not buffer:
+            return
+        grouped: dict[str, list[Frame]] = {}
+        for channel, frame in buffer:
+            grouped.setdefault(channel, []).append(frame)
+        pipe = self.redis.pipeline(transaction=False)
+        for channel, messages in grouped.items():
+            pipe.publish(channel, orjson.dumps(messages))
+        pipe.execute()
+
+    def _flush_loop(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(str(e))
+
+    def _apply_pending(self, pubsub: "PubSub") -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for is_sub, channel in pending:
+            if is_sub:
+                pubsub.subscribe(channel)
+            else:
+                pubsub.unsubscribe(channel)
+
+    def _listen(self) -> None:
+        while not self._stopped.is_set():
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                with self._lock:
+                    self._pending.clear()
+                    channels = list(self._channels)
+                pubsub.subscribe(*channels)
+                while not self._stopped.is_set():
+                    self._apply_pending(pubsub)
+                    message = pubsub.get_message(timeout=0.1)
+                    if message is None or message["type"] != "message" or self.handler is None:
+                        continue
+                    try:
+                        frames = [(key, data) for key, data in orjson.loads(message["data"])]
+                        self.handler(message["channel"].decode(), frames)
+                    except Exception as e:
+                        logger.exception(str(e))
+            except Exception as e:
+                # 连接断开后重新订阅
+                logger.exception(str(e))
+                time.sleep(1)
+            finally:
+                pubsub.close()
@@ -0,0 +1,106 @@
+"""连接发送队列.
+
+广播时如果直接在循环中调用 `ws.send`, 一个慢客户端会阻塞所有人, 已断开的连接还会在循环中途抛出异常。
+每个连接持有一个有界队列, 由独立的写线程负责发送, 投递方只做入队操作。
+
+队列满时的慢消费者策略:
+- drop_oldest: 丢弃最旧的消息。
+- coalesce: 带 key 的消息覆盖队列中同 key 的旧消息(如在线人数, 只需最新值), 仍然满则丢弃最旧的消息。
+- disconnect: 断开该连接, 客户端重连后重新同步。
+"""
+import threading
+from collections import deque
+from typing import TYPE_CHECKING, Any
+
+from simple_websocket import ConnectionClosed
+from structlog import getLogger
+
+if TYPE_CHECKING:
+    from structlog.stdlib import BoundLogger
+
+logger: "BoundLogger" = getLogger("ws")
+
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+
+class Outbox:
+    def __init__(self, ws: Any, maxsize: int = 100, policy: str = DROP_OLDEST) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"不支持的慢消费者策略: {policy}")
+        self.ws = ws
+        self.maxsize = maxsize
+        self.policy = policy
+        # (key, frame), key 为 None 的消息不参与合并
+        self._queue: deque[tuple[str | None, str | bytes]] = deque()
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self.closed = False
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def put(self, frame: str | bytes, key: str | None = None) -> bool:
+        """消息入队, 返回是否入队成功, 不会阻塞调用方."""
+        with self._cond:
+            if self.closed:
+                return False
+            if self.policy == COALESCE and key is not None:
+                for i, (queued_key, _) in enumerate(self._queue):
+                    if queued_key == key:
+                        self._queue[i] = (key, frame)
+                        return True
+            if len(self._queue) >= self.maxsize:
+                if self.policy == DISCONNECT:
+                    self._close_locked()
+                    self._disconnect()
+                    return False
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append((key, frame))
+            self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ws-outbox", daemon=True)
+                self._thread.start()
+            return True
+
+    def close(self) -> None:
+        with self._cond:
+            self._close_locked()
+
+    def _close_locked(self) -> None:
+        self.closed = True
+        self._queue.clear()
+        self._cond.notify_all()
+
+    def _disconnect(self) -> None:
+        logger.warning("slow websocket consumer disconnected", user_id=getattr(self.ws, "user_id", None))
+        # 在写线程外关闭, 避免在持锁时阻塞
+        threading.Thread(target=self._safe_close, daemon=True).start()
+
+    def _safe_close(self) -> None:
+        try:
+            self.ws.close(reason=1008, message="Too slow")
+        except Exception as e:
+            logger.debug(str(e))
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self.closed:
+                    self._cond.wait()
+                if self.closed:
+                    return
+                _, frame = self._queue.popleft()
+            try:
+                self.ws.send(frame)
+            except ConnectionClosed:
+                self.close()
+                return
+            except Exception as e:
+                logger.exception(str(e))
+                self.close()
+                return
@@ -0,0 +1,124 @@
+"""在线人数.
+
+连接/断开时不再立即通知所有连接(连接风暴时是 O(N²) 条消息), 而是标记为变更,
+由后台线程每隔 interval 秒合并计算一次, 人数有变化时才推送给当前进程的连接:
+
+    {"type": "online", "count": 当前在线人数, "delta": 与上次推送的差值}
+
+Presence 只统计当前进程, RedisPresence 使用 sorted set `ws:presence` 统计所有 worker,
+member 为 user_id, score 为最后心跳时间, 超过 ttl 未心跳的用户视为离线。
+"""
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any
+
+from redis import Redis
+from structlog import getLogger
+
+if TYPE_CHECKING:
+    from structlog.stdlib import BoundLogger
+
+    from .sock import Sock
+
+logger: "BoundLogger" = getLogger("ws")
+
+PRESENCE_KEY = "ws:presence"
+PRESENCE_MESSAGE_KEY = "online_count"
+
+
+class Presence:
+    def __init__(self, sock: "Sock", interval: float = 1.0) -> None:
+        self.sock = sock
+        self.interval = interval
+        self.count = 0
+        self._dirty = threading.Event()
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+
+    def message(self, delta: int = 0) -> dict[str, Any]:
+        return {"type": "online", "count": self.count, "delta": delta}
+
+    def touch(self) -> None:
+        """有连接变化, 下个周期重新统计."""
+        self._ensure_started()
+        self._dirty.set()
+
+    def leave(self, user_id: int) -> None:
+        """用户在当前进程的最后一个连接断开."""
+        self.touch()
+
+    def refresh(self) -> int:
+        """重新统计在线人数."""
+        return len(self.sock.registry.user_ids())
+
+    def tick(self) -> None:
+        """统计一次, 人数变化时推送差值."""
+        count = self.refresh()
+        delta = count - self.count
+        self.count = count
+        if delta:
+            self.sock.broadcast_local(self.message(delta), key=PRESENCE_MESSAGE_KEY)
+
+    def _ensure_started(self) -> None:
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            threading.Thread(target=self._run, name="ws-presence", daemon=True).start()
+            self._pid = pid
+
+    def _wait(self) -> None:
+        self._dirty.wait()
+
+    def _run(self) -> None:
+        while True:
+            self._wait()
+            self._dirty.clear()
+            try:
+                self.tick()
+            except Exception as e:
+                logger.exception(str(e))
+            # 一个周期内的多次变化只统计一次
+            time.sleep(self.interval)
+
+
+class RedisPresence(Presence):
+    """跨 worker 在线人数.
+
+    每个周期所有 worker 都会为本地用户续期心跳, 所以即使没有连接变化也会定期统计,
+    其他 worker 上的变化同样能推送到本地连接。用户在某个 worker 断开时直接从集合中移除,
+    如果他在其他 worker 上仍有连接, 下个周期会被那个 worker 重新加入。
+    """
+
+    def __init__(self, sock: "Sock", url: str, interval: float = 1.0, ttl: float = 30) -> None:
+        super().__init__(sock, interval)
+        self.url = url
+        self.ttl = ttl
+        self._redis: "Redis[bytes] | None" = None
+
+    @property
+    def redis(self) -> "Redis[bytes]":
+        if self._redis is None:
+            self._redis = Redis.from_url(self.url)
+        return self._redis
+
+    def leave(self, user_id: int) -> None:
+        self.redis.zrem(PRESENCE_KEY, str(user_id))
+        super().leave(user_id)
+
+    def refresh(self) -> int:
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        user_ids = self.sock.registry.user_ids()
+        if user_ids:
+            pipe.zadd(PRESENCE_KEY, {str(user_id): now for user_id in user_ids})
+        pipe.zremrangebyscore(PRESENCE_KEY, "-inf", now - self.ttl)
+        pipe.zcard(PRESENCE_KEY)
+        return int(pipe.execute()[-1])
+
+    def _wait(self) -> None:
+        # 每个周期都要心跳续期并获取其他 worker 的变化, 不需要等待本地变化
+        return
@@ -0,0 +1,444 @@
+import threading
+from collections.abc import Callable, Iterable
+from functools import wraps
+from typing import TYPE_CHECKING, Any
+
+from flask import Blueprint, Flask, current_app, request
+from flask.wrappers import Response
+from orjson import loads
+from simple_websocket import ConnectionClosed
+from simple_websocket import Server as _Server
+from structlog import getLogger
+from wsproto.events import (
+    AcceptConnection,
+    BytesMessage,
+    CloseConnection,
+    Ping,
+    Pong,
+    RejectConnection,
+    Request,
+    TextMessage,
+)
+from wsproto.extensions import PerMessageDeflate
+from wsproto.frame_protocol import CloseReason
+from wsproto.utilities import LocalProtocolError
+
+from src.common.auth.auth import JWTToken
+from src.common.metrics import WS_CONNECTIONS
+from src.config import config
+
+from .backplane import (
+    BROADCAST_CHANNEL,
+    USER_CHANNEL_PREFIX,
+    BaseBackplane,
+    Frame,
+    LocalBackplane,
+    RedisBackplane,
+    encode_message,
+    user_channel,
+)
+from .outbox import Outbox
+from .presence import PRESENCE_MESSAGE_KEY, Presence, RedisPresence
+
+if TYPE_CHECKING:
+    from _typeshed.wsgi import WSGIEnvironment
+    from structlog.stdlib import BoundLogger
+
+logger: "BoundLogger" = getLogger("ws")
+
+
+class Server(_Server):  # type: ignore[misc]
+    """在 simple_websocket 基础上增加鉴权和发送队列.
+
+    `send` 在当前线程同步发送, `enqueue` 放入连接自己的有界队列由写线程发送, 广播时使用后者.
+    """
+
+    def __init__(
+        self,
+        environ: "WSGIEnvironment",
+        subprotocols: list[Any] | None = None,
+        receive_bytes: int = 4096,
+        ping_interval: int | None = None,
+        max_message_size: int | None = None,
+        thread_class: Any = None,
+        event_class: Any = None,
+        selector_class: Any = None,
+        send_queue_size: int | None = None,
+        slow_consumer_policy: str | None = None,
+    ) -> None:
+        # token验证成功后保存 user_id
+        self.user_id: int | None = None
+        self.outbox = Outbox(
+            self,
+            send_queue_size or config.SOCK_SEND_QUEUE_SIZE,
+            slow_consumer_policy or config.SOCK_SLOW_CONSUMER_POLICY,
+        )
+        super().__init__(
+            environ,
+            subprotocols,
+            receive_bytes,
+            ping_interval,
+            max_message_size,
+            thread_class,
+            event_class,
+            selector_class,
+        )
+
+    def enqueue(self, frame: str | bytes, key: str | None = None) -> bool:
+        """非阻塞发送, frame 需已序列化."""
+        return self.outbox.put(frame, key)
+
+    def close(self, reason: int | None = None, message: str | None = None) -> None:
+        self.outbox.close()
+        super().close(reason, message)
+
+    def _handle_events(self) -> bool:  # noqa
+        keep_going = True
+        out_data = b""
+        for event in self.ws.events():
+            try:
+                if isinstance(event, Request):
+                    # 首次连接时鉴权
+                    token = None
+                    for item in event.extra_headers:
+                        if item[0] == b"token":
+                            # 前端传入的 token
+                            token = item[1].decode("utf-8")
+                    if token is None or (data := JWTToken.decode_token(token)) is None:
+                        # 验证未通过 拒绝连接
+                        out_data += self.ws.send(RejectConnection(status_code=401))
+                    else:
+                        # 验证通过 token中的数据 {'sub': user_id}
+                        self.user_id = int(data["sub"])
+                        self.subprotocol = self.choose_subprotocol(event)
+                        out_data += self.ws.send(
+                            AcceptConnection(subprotocol=self.subprotocol, extensions=[PerMessageDeflate()])
+                        )
+                elif isinstance(event, CloseConnection):
+                    if self.is_server:
+                        out_data += self.ws.send(event.response())
+                    self.close_reason = event.code
+                    self.close_message = event.reason
+                    self.connected = False
+                    self.event.set()
+                    keep_going = False
+                elif isinstance(event, Ping):
+                    out_data += self.ws.send(event.response())
+                elif isinstance(event, Pong):
+                    self.pong_received = True
+                elif isinstance(event, TextMessage | BytesMessage):
+                    self.incoming_message_len += len(event.data)  # type: ignore
+                    if self.max_message_size and self.incoming_message_len > self.max_message_size:  # type: ignore
+                        out_data += self.ws.send(CloseConnection(CloseReason.MESSAGE_TOO_BIG, "Message is too big"))
+                        self.event.set()
+                        keep_going = False
+                        break
+                    if self.incoming_message is None:  # type: ignore
+                        # store message as is first
+                        # if it is the first of a group, the message will be
+                        # converted to bytearray on arrival of the second
+                        # part, since bytearrays are mutable and can be
+                        # concatenated more efficiently
+                        self.incoming_message = event.data
+                    elif isinstance(event, TextMessage):
+                        if not isinstance(self.incoming_message, bytearray):
+                            # convert to bytearray and append
+                            self.incoming_message = bytearray((self.incoming_message + event.data).encode())
+                        else:
+                            # append to bytearray
+                            self.incoming_message += event.data.encode()
+                    else:
+                        if not isinstance(self.incoming_message, bytearray):
+                            # convert to mutable bytearray and append
+                            self.incoming_message = bytearray(self.incoming_message + event.data)
+                        else:
+                            # append to bytearray
+                            self.incoming_message += event.data
+                    if not event.message_finished:
+                        continue
+                    if isinstance(self.incoming_message, str | bytes):
+                        # single part message
+                        self.input_buffer.append(self.incoming_message)
+                    elif isinstance(event, TextMessage):
+                        # convert multi-part message back to text
+                        self.input_buffer.append(self.incoming_message.decode())
+                    else:
+                        # convert multi-part message back to bytes
+                        self.input_buffer.append(bytes(self.incoming_message))
+                    self.incoming_message = ""
+                    self.incoming_message_len = 0
+                    self.event.set()
+                else:
+                    pass
+            except LocalProtocolError:
+                out_data = b""
+                self.event.set()
+                keep_going = False
+        if out_data:
+            self.sock.send(out_data)
+        return keep_going
+
+
+class ConnectionRegistry:
+    """在线连接注册表, 按 user_id 索引.
+
+    同一用户可能多端(多个标签页)同时在线, 所以每个 user_id 对应一组连接.
+    所有读写都在锁内完成, 对外只返回快照, 遍历时不会因其他线程增删而报错.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._by_user: dict[int, set[Server]] = {}
+        self._all: set[Server] = set()
+
+    def add(self, ws: Server) -> bool:
+        """保存连接, 返回是否为该用户在当前进程的第一个连接."""
+        with self._lock:
+            self._all.add(ws)
+            if ws.user_id is None:
+                return False
+            sessions = self._by_user.setdefault(ws.user_id, set())
+            sessions.add(ws)
+            return len(sessions) == 1
+
+    def remove(self, ws: Server) -> bool:
+        """删除连接, 返回是否为该用户在当前进程的最后一个连接."""
+        with self._lock:
+            self._all.discard(ws)
+            if ws.user_id is None:
+                return False
+            sessions = self._by_user.get(ws.user_id)
+            if sessions is None:
+                return False
+            sessions.discard(ws)
+            if sessions:
+                return False
+            del self._by_user[ws.user_id]
+            return True
+
+    def get(self, user_id: int) -> set[Server]:
+        """获得某个用户的所有连接."""
+        with self._lock:
+            return set(self._by_user.get(user_id, ()))
+
+    def get_many(self, user_ids: Iterable[int]) -> set[Server]:
+        """获得一组用户的所有连接."""
+        res: set[Server] = set()
+        with self._lock:
+            for user_id in user_ids:
+                res.update(self._by_user.get(user_id, ()))
+        return res
+
+    def all(self) -> set[Server]:  # noqa: A003
+        with self._lock:
+            return set(self._all)
+
+    def user_ids(self) -> set[int]:
+        with self._lock:
+            return set(self._by_user)
+
+    def __len__(self) -> int:
+        return len(self._all)
+
+    def __contains__(self, ws: object) -> bool:
+        return ws in self._all
+
+
+class Sock:
+    """Websocket 扩展.
+
+    连接只保存在当前进程, 消息通过 backplane 转发给所有 worker 后再投递到本地连接,
+    所以 broadcast/send_one 在多 worker 部署下同样能送达所有客户端。
+    `broadcast_local`/`send_local` 只投递当前进程的连接。
+    """
+
+    def __init__(self, app: Flask | None = None, backplane: BaseBackplane | None = None) -> None:
+        self.app = app
+        self.bp: Blueprint = Blueprint("websocket", __name__)
+        self.registry = ConnectionRegistry()
+        self.after_close: Callable[[Any], Any] | None = None
+        self.backplane: BaseBackplane = backplane or LocalBackplane()
+        self.backplane.set_handler(self._deliver)
+        self.presence = Presence(self)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.register_blueprint(self.bp)
+        if config.SOCK_BACKPLANE == "redis":
+            self.set_backplane(RedisBackplane(config.REDIS_URL))
+            self.presence = RedisPresence(self, config.REDIS_URL, config.SOCK_PRESENCE_INTERVAL)
+        else:
+            self.presence = Presence(self, config.SOCK_PRESENCE_INTERVAL)
+        app.extensions["sock"] = self
+
+    def set_backplane(self, backplane: BaseBackplane) -> None:
+        self.backplane.close()
+        self.backplane = backplane
+        backplane.set_handler(self._deliver)
+        for user_id in self.registry.user_ids():
+            backplane.subscribe(user_channel(user_id))
+
+    def register_after_close(self, func: Callable[[Any], Any]) -> None:
+        # 注册前端关闭连接后操作
+        self.after_close = func
+
+    @property
+    def all_ws(self) -> set[Server]:
+        """当前进程所有连接的快照."""
+        return self.registry.all()
+
+    @property
+    def client_count(self) -> int:
+        """当前进程在线连接数."""
+        return len(self.registry)
+
+    @property
+    def online_count(self) -> int:
+        """所有 worker 在线人数, 每个统计周期更新一次."""
+        return self.presence.count
+
+    def route(self, path: str, **kwargs: Any) -> Callable[[Any], Any]:
+        """Decorator to create a WebSocket route.
+
+        The decorated function will be invoked when a WebSocket client
+        establishes a connection, with a WebSocket connection object passed
+        as an argument. Example::
+
+            @sock.route('/ws')
+            def websocket_route(ws):
+                # The ws object has the following methods:
+                # - ws.send(data)
+                # - ws.receive(timeout=None)
+                # - ws.close(reason=None, message=None)
+
+        If the route has variable components, the ``ws`` argument needs to be
+        included before them.
+
+        :param path: the URL associated with the route.
+        :param kwargs: additional route options. See the Flask documentation
+                       for the ``app.route`` decorator for details.
+        """
+
+        def decorator(f: Callable[[Any], Any]) -> Callable[[Any], Any]:
+            @wraps(f)
+            def websocket_route(*args: Any, **kwargs: Any) -> Any:
+                if not self.app and not self.bp:
+                    raise
+                ws = Server(request.environ, **current_app.config.get("SOCK_SERVER_OPTIONS", {}))
+                self._serve(ws, f, *args, **kwargs)
+
+                class WebSocketResponse(Response):
+                    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+                        if ws.mode == "gunicorn":
+                            raise StopIteration()
+                        if ws.mode == "werkzeug":
+                            raise ConnectionError()
+                        return []
+
+                return WebSocketResponse()
+
+            kwargs["websocket"] = True
+            return self.bp.route(path, **kwargs)(websocket_route)
+
+        return decorator
+
+    def _serve(self, ws: Server, f: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        """执行路由函数, 连接断开后删除保存的客户端并关闭连接."""
+        try:
+            f(ws, *args, **kwargs)
+        except ConnectionClosed:
+            pass
+        finally:
+            # 删除保存的客户端
+            if ws in self.registry:
+                self.remove(ws)
+                if self.after_close:
+                    self.after_close(self)
+        try:
+            ws.close()
+        except Exception as e:
+            logger.exception(str(e))
+
+    def add(self, ws: Server) -> None:
+        """保存客户端连接."""
+        if self.registry.add(ws) and ws.user_id is not None:
+            # 该用户在当前进程的第一个连接, 开始接收发给他的消息
+            self.backplane.subscribe(user_channel(ws.user_id))
+        self.presence.touch()
+        WS_CONNECTIONS.set(len(self.registry))
+
+    def remove(self, ws: Server) -> None:
+        """删除客户端连接."""
+        ws.outbox.close()
+        if self.registry.remove(ws) and ws.user_id is not None:
+            self.backplane.unsubscribe(user_channel(ws.user_id))
+            self.presence.leave(ws.user_id)
+        else:
+            self.presence.touch()
+        WS_CONNECTIONS.set(len(self.registry))
+
+    def broadcast(self, message: Any, key: str | None = None) -> None:
+        # 广播到所有 worker
+        # key: 相同 key 的消息在慢连接的发送队列中只保留最新一条(coalesce 策略)
+        self.backplane.publish(BROADCAST_CHANNEL, message, key)
+
+    def send_one(self, id: int, message: Any, key: str | None = None) -> None:
+        # 向某个用户的所有连接发送消息, 不论连接在哪个 worker
+        self.backplane.publish(user_channel(id), message, key)
+
+    def send_many(self, ids: Iterable[int], message: Any, key: str | None = None) -> None:
+        # 向一组用户的所有连接发送消息
+        self.backplane.publish_many((user_channel(id) for id in ids), message, key)
+
+    def get_ws_by_user_id(self, id: int) -> set[Server]:
+        # 通过 user_id 获得该用户在当前进程的所有 ws 实例
+        return self.registry.get(id)
+
+    def broadcast_local(self, message: Any, key: str | None = None) -> None:
+        # 广播到当前进程的连接
+        self._fan_out(self.all_ws, [(key, encode_message(message))])
+
+    def send_local(self, id: int, message: Any, key: str | None = None) -> None:
+        # 向某个用户在当前进程的所有连接发送消息
+        self._fan_out(self.get_ws_by_user_id(id), [(key, encode_message(message))])
+
+    def _deliver(self, channel: str, frames: list[Frame]) -> None:
+        """Backplane 收到消息后投递到本地连接."""
+        if channel == BROADCAST_CHANNEL:
+            clients = self.all_ws
+        elif channel.startswith(USER_CHANNEL_PREFIX):
+            clients = self.get_ws_by_user_id(int(channel.removeprefix(USER_CHANNEL_PREFIX)))
+        else:
+            return
+        self._fan_out(clients, frames)
+
+    @staticmethod
+    def _fan_out(clients: Iterable[Server], frames: list[Frame]) -> None:
+        # 已序列化的消息放入各连接的发送队列, 不在当前线程等待网络 IO
+        for client in clients:
+            for key, frame in frames:
+                client.enqueue(frame, key)
+
+
+sock = Sock()
+
+
+class Message:
+    type: str
+    message: Any
+
+
+@sock.route("/ws")
+def echo(ws):  # type: ignore # noqa
+    # 首次进入只给自己发送当前在线人数, 其他连接由 presence 定期合并推送
+    sock.add(ws)
+    ws.enqueue(encode_message(sock.presence.message()), key=PRESENCE_MESSAGE_KEY)
+    while True:
+        data = ws.receive()
+        try:
+            data = loads(data)
+        except Exception as e:
+            logger.exception(str(e))
+        # 只有 outbox 线程写连接, 路由线程直接 send 会与其并发写入压缩帧
+        ws.enqueue(encode_message(ws.user_id))
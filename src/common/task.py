@@ -1,8 +1,18 @@
 """Run: `wakaq-worker --app src.common.task.app`."""
-from wakaq import WakaQ
 
+import time
+
+from wakaq import CronTask, WakaQ
+
+from src.app import create_app
+from src.app.model.comment import INGEST_KEY, Comment
+from src.app.model.notice import Notice
+from src.app.model.post import tag_index
 from src.config import config
 
+from .db import db
+from .redis import redis
+from .search import SYNC_SCHEDULED_KEY, Searchable
 from .sms import SMS
 
 app = WakaQ(
@@ -13,7 +23,15 @@ app = WakaQ(
     max_retries=3,  # 最多重试3次
     max_mem_percent=90,  # 内存占用百分比
     max_tasks_per_worker=5000,  # 5000次后重启 worker
-    schedules=[],
+    schedules=[
+        # 每 10 分钟校对一次未读消息数
+        CronTask("*/10 * * * *", "reconcile_notice_unread"),
+        # 兜底: 防止评论写入、索引同步队列中有遗漏
+        CronTask("* * * * *", "ingest_comments"),
+        CronTask("* * * * *", "sync_search_index"),
+        # 批量删除的文章标签不会触发事件, 定时重建标签自动补全修正热度
+        CronTask("0 * * * *", "rebuild_tag_index"),
+    ],
     password=config.REDIS_PASSWORD,
 )
 
@@ -21,3 +39,72 @@ app = WakaQ(
 @app.task(queue="default-priority-queue", max_retries=7)
 def send_sms(mobile: str, code: str, expire: int | None = None) -> None:
     SMS.send(mobile, code, expire)
+
+
+@app.after_worker_started
+def init_db() -> None:
+    # worker 进程中没有 flask 请求上下文, 需要单独初始化数据库
+    db.init_app(create_app())
+
+
+@app.task(queue="default-priority-queue")
+def reconcile_notice_unread() -> None:
+    with db.scope():
+        Notice.reconcile_unread()
+
+
+@app.task(queue="default-priority-queue", soft_timeout=3600, hard_timeout=3660)
+def fanout_notice(job_id: str, content: str, from_user_id: int = 0) -> None:
+    """给所有用户发送系统消息."""
+    with db.scope():
+        Notice.fanout(job_id, content, from_user_id)
+
+
+INGEST_SCHEDULED_KEY = "comment:ingest:scheduled"
+# 同一时间只有一个写入任务, 过期时间与 hard_timeout 相同, 任务被终止后自动释放
+INGEST_RUNNING_KEY = "comment:ingest:running"
+INGEST_RUNNING_TTL = 60
+# 每个任务最多写入的时间(秒), 小于 soft_timeout, 剩下的由下一个任务继续
+INGEST_TIME_BUDGET = 20
+
+
+def schedule_comment_ingest() -> None:
+    """评论入队后调用, 同一时间只会有一个写入任务在排队或执行."""
+    if redis.set(INGEST_SCHEDULED_KEY, 1, nx=True, ex=60):
+        ingest_comments.delay()
+
+
+@app.task(queue="default-priority-queue")
+def ingest_comments() -> None:
+    """批量写入评论, 超过 INGEST_TIME_BUDGET 秒后调度下一个任务继续."""
+    if not redis.set(INGEST_RUNNING_KEY, 1, nx=True, ex=INGEST_RUNNING_TTL):
+        # 正在执行的任务结束时会再检查队列
+        return
+    try:
+        with db.scope():
+            # 被终止的任务未提交的评论、上次失败的评论在这次任务中重试
+            Comment.requeue_failed()
+            deadline = time.monotonic() + INGEST_TIME_BUDGET
+            while Comment.ingest() and time.monotonic() < deadline:
+                pass
+            redis.delete(INGEST_SCHEDULED_KEY)
+    finally:
+        redis.delete(INGEST_RUNNING_KEY)
+    # 没有写完或释放标记前入队的评论不会再触发任务, 需要再检查一次
+    if redis.llen(INGEST_KEY):
+        schedule_comment_ingest()
+
+
+@app.task(queue="default-priority-queue", soft_timeout=300, hard_timeout=360)
+def sync_search_index() -> None:
+    """批量写入窗口期内合并后的索引变更."""
+    # 先释放标记, 同步期间的新变更会调度下一个任务
+    redis.delete(SYNC_SCHEDULED_KEY)
+    with db.scope():
+        Searchable.sync()
+
+
+@app.task(queue="default-priority-queue")
+def rebuild_tag_index() -> None:
+    with db.scope():
+        tag_index.rebuild()
@@ -0,0 +1,141 @@
+"""请求耗时分解.
+
+每个请求开始时通过 start() 创建 Timing, 请求期间数据库、Redis、Elasticsearch 的每次调用都会记录次数和耗时,
+请求结束时写入 access 日志和 Server-Timing 响应头, N+1 查询会直接体现在 db 的次数上。
+
+- 数据库: instrument_engine(engine) 在 before/after_cursor_execute 事件中计时, 慢查询日志读取同一测量结果
+- Redis: 连接池使用 TimedConnection, 每读取一个响应记一次
+- Elasticsearch: 客户端使用 TimedNode, 每个 HTTP 请求记一次
+
+请求之外(任务队列、后台线程)没有 Timing, 不会记录。
+"""
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Any
+
+from elastic_transport import Urllib3HttpNode
+from redis.connection import Connection
+from sqlalchemy import Engine, event
+
+DB = "db"
+REDIS = "redis"
+ES = "es"
+
+QUERY_START_KEY = "timing_query_start"
+QUERY_DURATION_KEY = "timing_query_duration"
+
+
+class Timing:
+    """各类调用的次数和耗时(纳秒)."""
+
+    __slots__ = ("counts", "durations")
+
+    def __init__(self) -> None:
+        self.counts: dict[str, int] = {}
+        self.durations: dict[str, int] = {}
+
+    def record(self, name: str, duration: int, count: int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + count
+        self.durations[name] = self.durations.get(name, 0) + duration
+
+    def as_dict(self) -> dict[str, dict[str, int]]:
+        """用于 access 日志: {名称: {"count": 次数, "duration": 纳秒}}."""
+        return {name: {"count": count, "duration": self.durations[name]} for name, count in self.counts.items()}
+
+    def server_timing(self, total: int | None = None) -> str:
+        """Server-Timing 响应头, 单位为毫秒."""
+        metrics = [f'{name};dur={self.durations[name] / 1e6:.2f};desc="{count}"' for name, count in self.counts.items()]
+        if total is not None:
+            metrics.append(f"total;dur={total / 1e6:.2f}")
+        return ", ".join(metrics)
+
+
+ctx_timing: ContextVar[Timing | None] = ContextVar("timing", default=None)
+
+
+def start() -> Token[Timing | None]:
+    return ctx_timing.set(Timing())
+
+
+def stop(token: Token[Timing | None]) -> None:
+    ctx_timing.reset(token)
+
+
+def current() -> Timing | None:
+    return ctx_timing.get()
+
+
+def record(name: str, duration: int, count: int = 1) -> None:
+    timing = ctx_timing.get()
+    if timing is not None:
+        timing.record(name, duration, count)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """记录代码块的耗时."""
+    begin = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter_ns() - begin)
+
+
+def _before_cursor_execute(conn: Any, *args: Any) -> None:
+    conn.info.setdefault(QUERY_START_KEY, []).append(time.perf_counter_ns())
+
+
+def _after_cursor_execute(conn: Any, *args: Any) -> None:
+    duration = time.perf_counter_ns() - conn.info[QUERY_START_KEY].pop()
+    conn.info[QUERY_DURATION_KEY] = duration
+    record(DB, duration)
+
+
+def _handle_error(context: Any) -> None:
+    # 执行失败时没有 after_cursor_execute
+    starts = context.connection.info.get(QUERY_START_KEY) if context.connection is not None else None
+    if starts:
+        record(DB, time.perf_counter_ns() - starts.pop())
+
+
+def instrument_engine(engine: Engine) -> None:
+    """记录 engine 上每条语句的执行时间, 重复调用只注册一次."""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def query_duration(conn: Any) -> int | None:
+    """连接上最近一条语句的执行时间(纳秒), 在 instrument_engine 之后注册的 after_cursor_execute 中读取."""
+    duration: int | None = conn.info.get(QUERY_DURATION_KEY)
+    return duration
+
+
+class TimedConnection(Connection):
+    """记录 Redis 命令耗时的连接, pipeline 中的每个命令计为一次."""
+
+    def send_packed_command(self, *args: Any, **kwargs: Any) -> None:
+        begin = time.perf_counter_ns()
+        try:
+            super().send_packed_command(*args, **kwargs)
+        finally:
+            record(REDIS, time.perf_counter_ns() - begin, count=0)
+
+    def read_response(self, *args: Any, **kwargs: Any) -> Any:
+        begin = time.perf_counter_ns()
+        try:
+            return super().read_response(*args, **kwargs)
+        finally:
+            record(REDIS, time.perf_counter_ns() - begin)
+
+
+class TimedNode(Urllib3HttpNode):
+    """记录 Elasticsearch 请求耗时的节点."""
+
+    def perform_request(self, *args: Any, **kwargs: Any) -> Any:
+        with timed(ES):
+            return super().perform_request(*args, **kwargs)
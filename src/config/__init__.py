@@ -10,6 +10,10 @@ class BaseConfig(BaseSettings):
     SECRET_KEY: str = "123456"
     SQLALCHEMY_DATABASE_URI: str
     SQLALCHEMY_POOL_SIZE: int = 10
+    # 慢查询阈值(秒, 0-关闭), 同一结构的语句记录间隔(秒), 是否记录 SELECT 的执行计划
+    SLOW_QUERY_THRESHOLD: float = 0.5
+    SLOW_QUERY_INTERVAL: float = 60.0
+    SLOW_QUERY_EXPLAIN: bool = True
 
     # redis
     REDIS_PASSWORD: str
@@ -30,6 +34,49 @@ class BaseConfig(BaseSettings):
 
     # log
     LOG_LEVEL: str = "INFO"
+    # 日志队列长度, 大于 0 时由后台线程批量写入; 队列满时的策略: drop, block; 刷新到文件的间隔(秒)
+    LOG_QUEUE_SIZE: int = 0
+    LOG_QUEUE_POLICY: str = "drop"
+    LOG_FLUSH_INTERVAL: float = 1.0
+    # 单个日志文件大小上限(字节), 0-只按天切分; 切分出的文件是否 gzip 压缩
+    LOG_MAX_BYTES: int = 0
+    LOG_COMPRESS: bool = False
+    # 日志格式: console, json
+    LOG_FORMAT: str = "console"
+    # 2xx access 日志保留比例(0~1), 以及按路由规则覆盖, 如 {"/post/<int:id>": 0.01}
+    LOG_SAMPLE_RATE: float = 1.0
+    LOG_SAMPLE_ROUTES: dict[str, float] = {}
+    # 是否在响应头 Server-Timing 中返回数据库、Redis、Elasticsearch 的耗时
+    SERVER_TIMING: bool = True
+    # gunicorn 多 worker 时 prometheus 指标的 mmap 文件目录, 为空时只统计当前进程
+    METRICS_MULTIPROC_DIR: str = ""
+
+    # websocket 多 worker 消息分发: redis-通过 Redis pub/sub, local-仅当前进程
+    SOCK_BACKPLANE: str = "redis"
+    # 每个连接发送队列长度, 以及队列满时的策略: drop_oldest, coalesce, disconnect
+    SOCK_SEND_QUEUE_SIZE: int = 100
+    SOCK_SLOW_CONSUMER_POLICY: str = "coalesce"
+    # 在线人数合并推送周期(秒)
+    SOCK_PRESENCE_INTERVAL: float = 1.0
+
+    # 搜索后端: es-Elasticsearch, memory-进程内倒排索引(快照保存在 BASE_DIR 下的 SEARCH_INDEX_DIR)
+    SEARCH_BACKEND: str = "es"
+    SEARCH_INDEX_DIR: str = "search_index"
+    # elasticsearch, bulk 请求每批的文档数、字节数上限以及并行发送的线程数
+    ES_HOST: str = "http://127.0.0.1:9200"
+    ES_BULK_CHUNK_SIZE: int = 500
+    ES_BULK_MAX_BYTES: int = 10 * 1024 * 1024
+    ES_BULK_THREADS: int = 1
+    # 索引变更的合并窗口(秒), 窗口期内同一条数据的多次变更只写入一次
+    ES_SYNC_WINDOW: float = 1.0
+    # 搜索结果高亮: 标签、片段长度、片段数量(0-返回整个字段)以及片段之间的连接符
+    ES_HIGHLIGHT_PRE_TAG: str = "<span style='color: red; background: yellow;'>"
+    ES_HIGHLIGHT_POST_TAG: str = "</span>"
+    ES_HIGHLIGHT_FRAGMENT_SIZE: int = 100
+    ES_HIGHLIGHT_FRAGMENTS: int = 0
+    ES_HIGHLIGHT_SEPARATOR: str = "..."
+    # 搜索结果缓存时间(秒), 索引写入时全部失效
+    ES_SEARCH_CACHE_TTL: int = 60
 
     # secret
     ALGORITHM: str = "HS256"
@@ -1,11 +1,25 @@
 import logging
+import os
+import shutil
+from pathlib import Path
 
 from gunicorn.glogging import Logger as _GunicornLogger
 
 from src.common.log.log import Logger
 from src.config import config as _config
 
-Logger(is_production=False, log_level=_config.LOG_LEVEL)
+Logger(
+    is_production=False,
+    log_level=_config.LOG_LEVEL,
+    queue_size=_config.LOG_QUEUE_SIZE,
+    queue_policy=_config.LOG_QUEUE_POLICY,
+    flush_interval=_config.LOG_FLUSH_INTERVAL,
+    max_bytes=_config.LOG_MAX_BYTES,
+    compress=_config.LOG_COMPRESS,
+    log_format=_config.LOG_FORMAT,
+    sample_rate=_config.LOG_SAMPLE_RATE,
+    sample_routes=_config.LOG_SAMPLE_ROUTES,
+)
 
 bind = "0.0.0.0:5000"
 
@@ -28,3 +42,24 @@ class GunicornLogger(_GunicornLogger):  # type: ignore
 
 
 logger_class = GunicornLogger
+
+# Metrics
+
+if _config.METRICS_MULTIPROC_DIR:
+    # 必须在 worker 导入 prometheus_client 之前设置
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = _config.METRICS_MULTIPROC_DIR
+
+
+def on_starting(server):  # type: ignore # noqa
+    """清理上次运行留下的指标文件."""
+    if _config.METRICS_MULTIPROC_DIR:
+        shutil.rmtree(_config.METRICS_MULTIPROC_DIR, ignore_errors=True)
+        Path(_config.METRICS_MULTIPROC_DIR).mkdir(parents=True, exist_ok=True)
+
+
+def child_exit(server, worker):  # type: ignore # noqa
+    """已退出 worker 的 livesum 类型 gauge 不再参与统计."""
+    if _config.METRICS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess  # noqa: PLC0415
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -57,6 +57,12 @@ class Deleted(Success):
     error_code: int = 3
 
 
+class Accepted(Success):
+    code: int = 202
+    message: str = "已接受, 正在处理"
+    error_code: int = 4
+
+
 class Unautorization(APIException):
     code: int = 401
     message: str = "需要登录"
@@ -0,0 +1,18 @@
+import os
+
+# 导入 src 前提供必需的配置, 测试不会连接这些服务
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", "sqlite://")
+os.environ.setdefault("REDIS_URL", "redis://127.0.0.1:6379/0")
+os.environ.setdefault("REDIS_PASSWORD", "test")
+for name in (
+    "COS_SECRET_ID",
+    "COS_SECRET_KEY",
+    "COS_BUCKET",
+    "COS_REGION",
+    "SMS_SECRET_ID",
+    "SMS_SECRET_KEY",
+    "SMS_APP_ID",
+    "SMS_SIGN_NAME",
+    "SMS_TEMPLATE",
+):
+    os.environ.setdefault(name, "test")
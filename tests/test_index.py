@@ -0,0 +1,75 @@
+"""用 SQLite 的 EXPLAIN QUERY PLAN 检查常用查询使用了复合索引, 防止修改模型或查询后索引失效."""
+
+from collections.abc import Iterator
+
+import pytest
+from sqlalchemy import Connection, Select, create_engine
+from src.app.model.base import BaseModel
+from src.app.model.comment import Comment
+from src.app.model.notice import Notice
+from src.app.model.post import Post
+
+
+@pytest.fixture(scope="module")
+def conn() -> Iterator[Connection]:
+    engine = create_engine("sqlite://")
+    BaseModel.metadata.create_all(engine)
+    with engine.connect() as conn:
+        yield conn
+    engine.dispose()
+
+
+def query_plan(conn: Connection, statement: Select) -> str:
+    compiled = statement.compile(conn, compile_kwargs={"literal_binds": True})
+    return "\n".join(row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}"))
+
+
+@pytest.mark.parametrize(
+    ("statement", "search", "sorted_by_index"),
+    [
+        # 未读消息列表
+        (
+            Notice.select_all(to_user_id=1, is_read=0),
+            "SEARCH notice USING INDEX to_user_read_id (to_user_id=? AND is_read=?)",
+            True,
+        ),
+        # 所有消息, 已读和未读两部分需要合并排序
+        (
+            Notice.select_all(to_user_id=1),
+            "SEARCH notice USING INDEX to_user_read_id (to_user_id=?)",
+            False,
+        ),
+        # 文章的根评论
+        (
+            Comment.select_roots(1),
+            "SEARCH comment USING INDEX post_root_time (post_id=? AND root_id=?)",
+            True,
+        ),
+        # 根评论的回复, 不支持窗口函数时
+        (
+            Comment.select_replies([1, 2, 3]),
+            "SEARCH comment USING INDEX root_time (root_id=?)",
+            # 多个根评论的回复需要合并排序, 同一根评论下的回复数量有限
+            False,
+        ),
+        # 根评论的前几条回复, 窗口函数
+        (
+            Comment.select_top_replies([1, 2, 3], 3),
+            "SEARCH comment USING INDEX root_time (root_id=?)",
+            False,
+        ),
+        # 分类下的文章列表
+        (
+            Post.select_latest(1).limit(10),
+            "SEARCH post USING INDEX category_time (category_id=?)",
+            True,
+        ),
+    ],
+)
+def test_query_use_index(conn: Connection, statement: Select, search: str, sorted_by_index: bool) -> None:
+    plan = query_plan(conn, statement)
+    assert search in plan.splitlines(), plan
+    if sorted_by_index:
+        # SQLite 中 BIGINT 主键不是 rowid, 按 id 的补充排序会显示为 "RIGHT PART OF ORDER BY";
+        # InnoDB 的二级索引包含主键, 不需要这部分排序
+        assert "USE TEMP B-TREE FOR ORDER BY" not in plan, plan
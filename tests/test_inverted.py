@@ -0,0 +1,111 @@
+"""进程内倒排索引后端, 不依赖 Elasticsearch."""
+
+import multiprocessing
+from pathlib import Path
+
+import pytest
+from src.common.search.backend import OP_DELETE, OP_INDEX
+from src.common.search.inverted import InvertedIndexBackend, highlight, tokenize
+
+INDEX = "post"
+PROPERTIES = {"title": {"type": "text"}, "content": {"type": "text"}}
+FIELDS = list(PROPERTIES)
+
+
+@pytest.fixture()
+def backend(tmp_path: Path) -> InvertedIndexBackend:
+    backend = InvertedIndexBackend(tmp_path, reload_interval=0)
+    backend.create_index(INDEX, PROPERTIES)
+    return backend
+
+
+def ids(backend: InvertedIndexBackend, q: str) -> list[int]:
+    _, hits = backend.search(INDEX, q, FIELDS, 1, 10)
+    return [id for id, _, _ in hits]
+
+
+def test_tokenize_cjk_bigrams() -> None:
+    assert [token for token, _, _ in tokenize("Flask 中文分词")] == ["flask", "中文", "文分", "分词"]
+    # 单独的一个字保留单字, 位置对应原文
+    assert tokenize("a字") == [("a", 0, 1), ("字", 1, 2)]
+
+
+def test_search_ranking(backend: InvertedIndexBackend) -> None:
+    backend.bulk(
+        INDEX,
+        [
+            {"_op_type": OP_INDEX, "_id": 1, "_source": {"title": "python", "content": "flask flask flask"}},
+            {"_op_type": OP_INDEX, "_id": 2, "_source": {"title": "flask", "content": "python"}},
+            {"_op_type": OP_INDEX, "_id": 3, "_source": {"title": "rust", "content": "tokio"}},
+        ],
+    )
+    assert ids(backend, "flask") == [1, 2]
+    assert ids(backend, "tokio") == [3]
+    assert ids(backend, "django") == []
+    total, hits = backend.search(INDEX, "flask", FIELDS, 2, 1, source=["title"])
+    assert total == 2
+    assert hits == [(2, {"title": "flask"}, {})]
+    # ids 限制搜索范围
+    assert backend.search(INDEX, "flask", FIELDS, 1, 10, ids=[2])[0] == 1
+
+
+def test_search_cjk(backend: InvertedIndexBackend) -> None:
+    backend.index(INDEX, 1, {"title": "中文分词", "content": ""})
+    backend.index(INDEX, 2, {"title": "英文文档", "content": ""})
+    assert ids(backend, "分词") == [1]
+    assert ids(backend, "文分") == [1]
+    assert ids(backend, "文档") == [2]
+
+
+def test_highlight() -> None:
+    terms = {token for token, _, _ in tokenize("中文分词")}
+    # 重叠的 bigram 合并为一个标签
+    assert highlight("支持中文分词吗", terms, "<em>", "</em>") == ["支持<em>中文分词</em>吗"]
+    assert highlight("hello world", {"world"}, "<b>", "</b>") == ["hello <b>world</b>"]
+    assert highlight("hello world", {"python"}, "<b>", "</b>") == []
+    text = "python " + "x" * 50 + " python"
+    fragments = highlight(text, {"python"}, "[", "]", fragment_size=10, number_of_fragments=1)
+    assert fragments == ["[python] xxx"]
+
+
+def test_search_highlight(backend: InvertedIndexBackend) -> None:
+    backend.index(INDEX, 1, {"title": "Flask 教程", "content": "使用 flask 开发"})
+    options = {"fields": {"title": {}, "content": {}}, "pre_tags": ["<em>"], "post_tags": ["</em>"]}
+    _, hits = backend.search(INDEX, "flask", FIELDS, 1, 10, highlight=options)
+    assert hits[0][2] == {"title": ["<em>Flask</em> 教程"], "content": ["使用 <em>flask</em> 开发"]}
+
+
+def test_delete(backend: InvertedIndexBackend) -> None:
+    backend.index(INDEX, 1, {"title": "flask", "content": ""})
+    backend.index(INDEX, 2, {"title": "flask", "content": ""})
+    backend.delete(INDEX, 1)
+    assert ids(backend, "flask") == [2]
+    # 删除不存在的文档不算失败
+    assert backend.bulk(INDEX, [{"_op_type": OP_DELETE, "_id": 1}]) == (1, 0)
+    # 更新即删除后重新添加
+    backend.index(INDEX, 2, {"title": "django", "content": ""})
+    assert ids(backend, "flask") == []
+    assert ids(backend, "django") == [2]
+
+
+def _write_in_child(path: Path) -> None:
+    backend = InvertedIndexBackend(path)
+    backend.create_index(INDEX, PROPERTIES)
+    backend.index(INDEX, 2, {"title": "from child", "content": ""})
+    backend.delete(INDEX, 1)
+
+
+def test_reload_from_other_process(backend: InvertedIndexBackend, tmp_path: Path) -> None:
+    backend.index(INDEX, 1, {"title": "from parent", "content": ""})
+    assert ids(backend, "parent") == [1]
+    process = multiprocessing.get_context("fork").Process(target=_write_in_child, args=(tmp_path,))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    # 子进程的写入只追加到日志, 没有生成快照
+    assert backend.log_path(INDEX).exists()
+    assert not backend.snapshot_path(INDEX).exists()
+    assert ids(backend, "child") == [2]
+    assert ids(backend, "parent") == []
+    # 新进程从日志加载出相同的结果
+    assert ids(InvertedIndexBackend(tmp_path), "child") == [2]